@@ -0,0 +1,107 @@
+"""Measure start-to-exit time of `main.py --once` against local stand-in servers.
+
+Every run is a fresh interpreter, like a systemd timer would start it. The
+first run also creates the database, the others find the schema current:
+
+    python benchmarks/cold_start.py --runs 10 --size 100
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import runpy
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MAIN_PY = ROOT / "src" / "main.py"
+
+
+def _run_child(stub_url: str, config_dir: str) -> None:
+    """Point the fetcher at the stubs, then run main.py like the timer does."""
+    sys.path.insert(0, str(MAIN_PY.parent))
+    from game_notifier import fetcher
+
+    fetcher.EPIC_PROMOTIONS_URL = f"{stub_url}/freeGamesPromotions"
+    fetcher.STEAM_APPDETAILS_URL = f"{stub_url}/api/appdetails"
+    sys.argv = [str(MAIN_PY), "--run", "--once", "--config-dir", config_dir]
+    runpy.run_path(str(MAIN_PY), run_name="__main__")
+
+
+def _wall_time(args: list[str]) -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, *args],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        cwd=ROOT,
+    )
+    return time.perf_counter() - started
+
+
+def parse_args():
+    """Handle provided arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--size", type=int, default=100, help="steam games watched")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument(
+        "--output", type=Path, default=Path("bench_start.json"), help="JSON report"
+    )
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    """Time the runs, or be one of them with `--child`."""
+    args = parse_args()
+    if args.child:
+        _run_child(*args.child)
+        return
+
+    sys.path.insert(0, str(Path(__file__).parent))
+    from poll_cycle import _git_revision
+    from stubs import StubConfig, StubServer
+
+    with StubServer(StubConfig(latency=args.latency)) as stub:
+        with tempfile.TemporaryDirectory() as tmp:
+            config_dir = Path(tmp)
+            game_ids = ",".join(str(i) for i in range(1, args.size + 1))
+            config_dir.joinpath(".env").write_text(
+                f"NTFY_TOPIC={stub.url}/topic\n"
+                "EPIC_NOTIFY_FREE_GAMES=true\n"
+                f"STEAM_WANTED_GAMES={game_ids}\n"
+                "NTFY_RATE_LIMIT=1000000\n"
+                "STEAM_REQUESTS_PER_MINUTE=0\n"
+            )
+            child = [__file__, "--child", stub.url, str(config_dir)]
+            runs = [_wall_time(child) for _ in range(args.runs)]
+
+    interpreter = min(_wall_time(["-c", "pass"]) for _ in range(5))
+    src = str(MAIN_PY.parent)
+    import_main = f"import sys; sys.path.insert(0, {src!r}); import main"
+    imports = min(_wall_time(["-c", import_main]) for _ in range(5))
+    report = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "watchlist_size": args.size,
+        "interpreter_s": round(interpreter, 4),
+        "import_main_s": round(imports - interpreter, 4),
+        "first_run_s": round(runs[0], 4),
+        "run_median_s": round(statistics.median(runs[1:] or runs), 4),
+        "run_min_s": round(min(runs[1:] or runs), 4),
+    }
+    for key, value in report.items():
+        print(f"{key:>16}: {value}")
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
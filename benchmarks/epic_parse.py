@@ -0,0 +1,89 @@
+"""Compare decoding the whole Epic promotions document with `parse_epic_promotions`.
+
+Measures parse time and peak memory of both, plus the memory kept afterwards,
+which is what stays cached between polls:
+
+    python benchmarks/epic_parse.py --games 500 --payload-size 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from game_notifier import fetcher  # noqa: E402
+
+from poll_cycle import _git_revision  # noqa: E402
+from stubs import StubConfig, StubServer  # noqa: E402
+
+
+def _whole_document(body: bytes) -> Any:
+    """Decode everything, like the cache held before: every element in full."""
+    return json.loads(body)["data"]["Catalog"]["searchStore"]["elements"]
+
+
+def _measure(parse: Callable[[bytes], Any], body: bytes, runs: int) -> dict:
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        parse(body)
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    result = parse(body)
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {
+        "parse_min_s": round(min(times), 5),
+        "peak_kib": round(peak / 1024, 1),
+        "kept_kib": round(kept / 1024, 1),
+    }
+
+
+def parse_args():
+    """Handle provided arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=500)
+    parser.add_argument(
+        "--payload-size", type=int, default=2_000, help="bytes of filler per game"
+    )
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--output", type=Path, default=Path("bench_epic.json"), help="JSON report"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Compare both parsers on one stub promotions document."""
+    args = parse_args()
+    stub_config = StubConfig(epic_games=args.games, payload_size=args.payload_size)
+    with StubServer(stub_config) as stub:
+        body = stub._epic_body
+
+    report = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "games": args.games,
+        "body_kib": round(len(body) / 1024, 1),
+        "whole_document": _measure(_whole_document, body, args.runs),
+        "parse_epic_promotions": _measure(
+            fetcher.parse_epic_promotions, body, args.runs
+        ),
+    }
+    print(json.dumps(report, indent=2))
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
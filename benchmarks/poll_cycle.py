@@ -0,0 +1,162 @@
+"""Measure poll cycles against local stand-in servers.
+
+Runs one cold and one warm cycle of the engine for every combination of
+watchlist size and tenant count and writes the results as JSON, e.g.:
+
+    python benchmarks/poll_cycle.py --sizes 10 100 1000 --tenants 1 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from game_notifier import config, database, engine, fetcher, http_client  # noqa: E402
+
+from stubs import StubConfig, StubServer  # noqa: E402
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).parent,
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _tenant_configs(
+    root: Path, stub: StubServer, size: int, tenants: int
+) -> list[tuple[Path, config.Settings]]:
+    """Give every tenant `size` appids, overlapping half with the previous one."""
+    configs = []
+    for t in range(tenants):
+        working_dir = root / f"tenant-{t}"
+        working_dir.mkdir()
+        first = 1 + t * size // 2
+        settings = config.parse_settings(
+            {
+                "NTFY_TOPIC": f"{stub.url}/topic-{t}",
+                "EPIC_NOTIFY_FREE_GAMES": "true",
+                "STEAM_WANTED_GAMES": ",".join(
+                    str(i) for i in range(first, first + size)
+                ),
+                "NTFY_RATE_LIMIT": "1000000",
+                "MAX_CONNECTIONS_PER_HOST": "8",
+            }
+        )
+        configs.append((working_dir, settings))
+    return configs
+
+
+def _measure_cycle(
+    stub: StubServer, configs: list[tuple[Path, config.Settings]]
+) -> dict:
+    stub.reset_counts()
+    tracemalloc.start()
+    started = time.perf_counter()
+    # the engine prints every notification, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(engine.run_once(configs))
+    wall_time = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wall_time_s": round(wall_time, 4),
+        "requests": sum(stub.requests.values()),
+        "requests_by_endpoint": dict(stub.requests),
+        "peak_memory_bytes": peak,
+    }
+
+
+def run_scenario(stub: StubServer, size: int, tenants: int) -> dict:
+    """Measure a cold and a warm cycle of `tenants` watching `size` games each."""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        configs = _tenant_configs(root, stub, size, tenants)
+        http_client.configure(cache_dir=root / "cache")
+        with contextlib.redirect_stdout(io.StringIO()):
+            for working_dir, _ in configs:
+                database.init_sqlite_db(working_dir)
+        try:
+            cold = _measure_cycle(stub, configs)
+            warm = _measure_cycle(stub, configs)
+        finally:
+            database.close_databases()
+            http_client.close()
+    return {"watchlist_size": size, "tenants": tenants, "cold": cold, "warm": warm}
+
+
+def parse_args():
+    """Handle provided arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 1_000, 10_000]
+    )
+    parser.add_argument("--tenants", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--payload-size", type=int, default=2_000)
+    parser.add_argument("--discount-share", type=float, default=0.1)
+    parser.add_argument(
+        "--output", type=Path, default=Path("bench_output.json"), help="JSON report"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Run every scenario and write the report."""
+    args = parse_args()
+    stub_config = StubConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        payload_size=args.payload_size,
+        discount_share=args.discount_share,
+    )
+    # failures should show up in the numbers instead of being retried away
+    http_client.configure(max_retries=0)
+
+    results = []
+    with StubServer(stub_config) as stub:
+        fetcher.EPIC_PROMOTIONS_URL = f"{stub.url}/freeGamesPromotions"
+        fetcher.STEAM_APPDETAILS_URL = f"{stub.url}/api/appdetails"
+        for tenants in args.tenants:
+            for size in args.sizes:
+                result = run_scenario(stub, size, tenants)
+                results.append(result)
+                print(
+                    f"size={size:>6} tenants={tenants:>2} "
+                    f"cold={result['cold']['wall_time_s']:.3f}s "
+                    f"({result['cold']['requests']} req) "
+                    f"warm={result['warm']['wall_time_s']:.3f}s "
+                    f"({result['warm']['requests']} req) "
+                    f"peak={result['cold']['peak_memory_bytes'] / 1e6:.1f}MB"
+                )
+
+    report = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "stub": vars(stub_config),
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Simulate weeks of polling in seconds to plan capacity.
+
+Runs the sequential notifier loop on a virtual clock against local stand-in
+servers. Every wait only moves the clock, so a month takes seconds. Sales
+and free games rotate every `--rotation-days`:
+
+    python benchmarks/simulate.py --days 90 --steam-games 500
+
+Recorded Epic promotions documents can be replayed instead of synthetic ones.
+Name each file after the unix timestamp it was fetched at, for example from
+a cron job running
+`curl -o recordings/$(date +%s).json <promotions url>`. The simulation
+starts at the first recording unless `--start` is given:
+
+    python benchmarks/simulate.py --days 30 --epic-recordings recordings/
+
+The report has the notifications sent, the requests made per endpoint and
+how the database grew, day by day.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from game_notifier import clock, database, fetcher, http_client, notifier  # noqa: E402
+
+from poll_cycle import _git_revision  # noqa: E402
+from stubs import DAY, StubConfig, StubServer  # noqa: E402
+
+
+def _database_stats(working_dir: Path) -> dict:
+    path = working_dir / database.DB_FILENAME
+    conn = sqlite3.connect(path)
+    try:
+        # until a checkpoint the new pages are only in the WAL file
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        tables = [
+            name
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+                " AND name NOT LIKE 'sqlite_%'"
+            )
+        ]
+        rows = {
+            table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            for table in tables
+        }
+    finally:
+        conn.close()
+    files = [path, *(path.with_name(f"{path.name}-{s}") for s in ("wal", "shm"))]
+    return {
+        "size_bytes": sum(f.stat().st_size for f in files if f.exists()),
+        "rows": rows,
+    }
+
+
+class DailySampler:
+    """Counts cycles and samples the database once per simulated day.
+
+    Passed to the loop in place of a profiler, it wraps every cycle.
+    """
+
+    def __init__(self, working_dir: Path, start: float):
+        """Sample the database in `working_dir`, days count from `start`."""
+        self.working_dir = working_dir
+        self.start = start
+        self.cycles = 0
+        self.days: list[dict] = []
+
+    @contextmanager
+    def cycle(self) -> Iterator[None]:
+        """Run one cycle, then sample if a new day has begun."""
+        yield
+        self.cycles += 1
+        day = int((clock.time() - self.start) // DAY)
+        if not self.days or self.days[-1]["day"] < day:
+            stats = _database_stats(self.working_dir)
+            self.days.append({"day": day, "cycles": self.cycles, **stats})
+
+
+def _load_recordings(directory: Path) -> list[tuple[float, bytes]]:
+    recordings = []
+    for path in directory.glob("*.json"):
+        try:
+            recorded = float(path.stem)
+        except ValueError:
+            print(f"skipping {path}, its name is not a unix timestamp")
+            continue
+        recordings.append((recorded, path.read_bytes()))
+    return sorted(recordings)
+
+
+def simulate(args, recordings: list[tuple[float, bytes]]) -> dict:
+    """Run the loop for `args.days` on a virtual clock and return the report."""
+    if args.start is not None:
+        start = args.start.replace(tzinfo=args.start.tzinfo or timezone.utc)
+        start_time = start.timestamp()
+    elif recordings:
+        start_time = recordings[0][0]
+    else:
+        start_time = time.time()
+    virtual = clock.VirtualClock(start_time)
+    previous = clock.set_clock(virtual)
+
+    stub_config = StubConfig(
+        payload_size=args.payload_size,
+        epic_games=args.epic_games,
+        discount_share=args.discount_share,
+        rotation=args.rotation_days * DAY,
+    )
+    steam_game_ids = list(range(1, args.steam_games + 1))
+    try:
+        with StubServer(stub_config, virtual.time, recordings) as stub:
+            fetcher.EPIC_PROMOTIONS_URL = f"{stub.url}/freeGamesPromotions"
+            fetcher.STEAM_APPDETAILS_URL = f"{stub.url}/api/appdetails"
+            with tempfile.TemporaryDirectory() as tmp:
+                working_dir = Path(tmp)
+                http_client.configure(max_retries=0, cache_dir=working_dir / "cache")
+                with contextlib.redirect_stdout(io.StringIO()):
+                    database.init_sqlite_db(working_dir)
+                initial = _database_stats(working_dir)
+                sampler = DailySampler(working_dir, start_time)
+                started = time.perf_counter()
+                # the loop prints every notification, keep the report readable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    notifier.loop(
+                        f"{stub.url}/topic",
+                        args.poll_interval,
+                        bool(args.epic_games or recordings),
+                        steam_game_ids,
+                        working_dir,
+                        rate_limit=args.ntfy_rate_limit,
+                        profiler=sampler,
+                        until=start_time + args.days * DAY,
+                    )
+                wall_time = time.perf_counter() - started
+                final = _database_stats(working_dir)
+                database.close_databases()
+                http_client.close()
+    finally:
+        clock.set_clock(previous)
+
+    requests = dict(stub.requests)
+    return {
+        "start": datetime.fromtimestamp(start_time, timezone.utc).isoformat(),
+        "simulated_days": args.days,
+        "wall_time_s": round(wall_time, 3),
+        "cycles": sampler.cycles,
+        "notifications_sent": requests.get("ntfy", 0),
+        "requests": sum(requests.values()) - requests.get("ntfy", 0),
+        "requests_by_endpoint": requests,
+        "database_initial": initial,
+        "database_final": final,
+        "database_by_day": sampler.days,
+    }
+
+
+def parse_args():
+    """Handle provided arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--poll-interval", type=int, default=60, help="minutes")
+    parser.add_argument("--steam-games", type=int, default=100)
+    parser.add_argument("--epic-games", type=int, default=20)
+    parser.add_argument("--rotation-days", type=float, default=7)
+    parser.add_argument("--discount-share", type=float, default=0.1)
+    parser.add_argument("--payload-size", type=int, default=2_000)
+    parser.add_argument("--ntfy-rate-limit", type=float, default=12)
+    parser.add_argument(
+        "--start",
+        type=datetime.fromisoformat,
+        help="ISO date to start at, default now or the first recording",
+    )
+    parser.add_argument(
+        "--epic-recordings", type=Path, help="directory of <timestamp>.json files"
+    )
+    parser.add_argument(
+        "--output", type=Path, default=Path("bench_simulate.json"), help="JSON report"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Simulate, print a summary and write the report."""
+    args = parse_args()
+    recordings = _load_recordings(args.epic_recordings) if args.epic_recordings else []
+    result = simulate(args, recordings)
+    final = result["database_final"]
+    print(
+        f"{result['simulated_days']:g} days in {result['wall_time_s']:.1f}s: "
+        f"{result['cycles']} cycles, {result['requests']} requests, "
+        f"{result['notifications_sent']} notifications, database "
+        f"{result['database_initial']['size_bytes'] / 1024:.0f} KiB -> "
+        f"{final['size_bytes'] / 1024:.0f} KiB"
+    )
+    report = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        **result,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
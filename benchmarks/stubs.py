@@ -0,0 +1,242 @@
+"""Local stand-ins for the Epic, Steam and ntfy endpoints."""
+
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class StubConfig:
+    """How the stand-in servers answer."""
+
+    latency: float = 0.0  # seconds added to every response
+    error_rate: float = 0.0  # share of requests answered with 503
+    payload_size: int = 2_000  # bytes of filler in every game object
+    epic_games: int = 20  # elements in the promotions document
+    discount_share: float = 0.1  # share of steam games that are on sale
+    rotation: float = 0.0  # seconds until sales and free games change, 0 never
+    seed: int = 0
+
+
+DAY = 24 * 60 * 60
+
+
+def _epic_date(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S.000Z"
+    )
+
+
+class StubServer:
+    """Threaded HTTP server answering like the real upstreams.
+
+    - `/freeGamesPromotions` like the Epic promotions document
+    - `/api/appdetails` like Steam, with and without `filters=price_overview`
+    - any POST like a ntfy topic
+
+    Promotions and sales are built for the time of `clock`, with a
+    `rotation` they change every period. Recorded Epic documents, given as
+    (fetch timestamp, body) pairs, are served instead of built ones: always
+    the latest one recorded before the time of `clock`.
+    """
+
+    def __init__(
+        self,
+        config: StubConfig,
+        clock: Callable[[], float] = time.time,
+        epic_recordings: Optional[list[tuple[float, bytes]]] = None,
+    ):
+        """Bind to a free local port, requests are served once entered."""
+        self.config = config
+        self.requests: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._clock = clock
+        self._epic_recordings = sorted(epic_recordings or [])
+        self._epic_body = self._build_epic_body()
+        self._epic_period = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server."""
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self) -> StubServer:
+        """Start serving in a background thread."""
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counts(self):
+        """Forget the requests counted so far."""
+        with self._lock:
+            self.requests.clear()
+
+    def _filler(self) -> str:
+        return "x" * self.config.payload_size
+
+    def _period(self) -> int:
+        if not self.config.rotation:
+            return 0
+        return int(self._clock() // self.config.rotation)
+
+    def _epic_document(self) -> bytes:
+        if self._epic_recordings:
+            now = self._clock()
+            body = self._epic_recordings[0][1]
+            for recorded, recording in self._epic_recordings:
+                if recorded > now:
+                    break
+                body = recording
+            return body
+        period = self._period()
+        with self._lock:
+            if period != self._epic_period:
+                self._epic_body = self._build_epic_body(period)
+                self._epic_period = period
+            return self._epic_body
+
+    def _build_epic_body(self, period: int = 0) -> bytes:
+        if self.config.rotation:
+            start = period * self.config.rotation
+            end = start + self.config.rotation
+        else:
+            start, end = self._clock() - DAY, self._clock() + 6 * DAY
+        elements = []
+        for i in range(self.config.epic_games):
+            offers = []
+            if (i + period) % 5 == 0:
+                offers = [
+                    {
+                        "promotionalOffers": [
+                            {
+                                "startDate": _epic_date(start),
+                                "endDate": _epic_date(end),
+                                "discountSetting": {"discountType": "PERCENTAGE"},
+                            }
+                        ]
+                    }
+                ]
+            elements.append(
+                {
+                    "title": f"Epic Game {i}",
+                    "description": self._filler(),
+                    "keyImages": [
+                        {"type": kind, "url": f"https://img/{i}-{kind}.jpg"}
+                        for kind in (
+                            "OfferImageTall",
+                            "OfferImageWide",
+                            "Thumbnail",
+                            "DieselStoreFrontWide",
+                            "VaultClosed",
+                        )
+                    ],
+                    # like the real document, most of an element is never used
+                    "categories": [{"path": f"games/{c}"} for c in range(5)],
+                    "customAttributes": [
+                        {"key": f"com.epicgames.attribute{a}", "value": f"{a}"}
+                        for a in range(10)
+                    ],
+                    "tags": [{"id": str(t)} for t in range(10)],
+                    "offerMappings": [{"pageSlug": f"epic-game-{i}"}],
+                    "price": {"totalPrice": {"discountPrice": 0 if offers else 1999}},
+                    "promotions": {
+                        "promotionalOffers": offers,
+                        "upcomingPromotionalOffers": [],
+                    },
+                }
+            )
+        body = {"data": {"Catalog": {"searchStore": {"elements": elements}}}}
+        return json.dumps(body).encode("utf-8")
+
+    def _is_discounted(self, appid: int) -> bool:
+        # every period puts other games on sale
+        key = appid + self._period() * 7919
+        return (key * 2654435761 % 1000) < self.config.discount_share * 1000
+
+    def _steam_body(self, appids: list[int], price_only: bool) -> bytes:
+        body = {}
+        for appid in appids:
+            discount = 50 if self._is_discounted(appid) else 0
+            price = {
+                "currency": "EUR",
+                "initial": 1999,
+                "final": 1999 * (100 - discount) // 100,
+                "discount_percent": discount,
+                "final_formatted": f"{1999 * (100 - discount) // 100 / 100:.2f}€",
+            }
+            data = {"price_overview": price}
+            if not price_only:
+                data.update(
+                    name=f"Steam Game {appid}",
+                    header_image=f"https://steam/{appid}/header.jpg",
+                    detailed_description=self._filler(),
+                )
+            body[str(appid)] = {"success": True, "data": data}
+        return json.dumps(body).encode("utf-8")
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, delayed ACKs would
+            # add 40ms to every response on a kept alive connection
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _answer(self, endpoint: str) -> bool:
+                with stub._lock:
+                    stub.requests[endpoint] += 1
+                    failed = stub._random.random() < stub.config.error_rate
+                if stub.config.latency:
+                    time.sleep(stub.config.latency)
+                if failed:
+                    self._send(503, b"")
+                return not failed
+
+            def _send(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path.endswith("/freeGamesPromotions"):
+                    if self._answer("epic"):
+                        self._send(200, stub._epic_document())
+                elif url.path.endswith("/api/appdetails"):
+                    price_only = "filters" in query
+                    if self._answer("steam_prices" if price_only else "steam_details"):
+                        appids = [int(a) for a in query["appids"][0].split(",")]
+                        self._send(200, stub._steam_body(appids, price_only))
+                else:
+                    self._send(404, b"")
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self._answer("ntfy"):
+                    self._send(200, b"{}")
+
+        return Handler
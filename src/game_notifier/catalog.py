@@ -0,0 +1,65 @@
+"""Local catalog of all Steam apps to resolve game names to appids."""
+
+from __future__ import annotations
+
+import json
+from dataclasses import replace
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from game_notifier import database
+
+if TYPE_CHECKING:
+    from game_notifier.config import Settings
+
+
+def import_catalog(working_dir: Path, source: Optional[str] = None) -> int:
+    """Import an app list from a URL or a JSON dump, returns how many apps changed.
+
+    Without `source` the list is requested from Steam. Running it again
+    later only writes apps that are new or were renamed.
+    """
+    from game_notifier import fetcher
+
+    source = source or fetcher.STEAM_APP_LIST_URL
+    dump = Path(source)
+    if dump.is_file():
+        apps = fetcher.parse_steam_app_list(json.loads(dump.read_text("utf-8")))
+    else:
+        apps = fetcher.steam_app_list(source)
+    return database.open_database(working_dir).update_steam_catalog(apps)
+
+
+def resolve_steam_games(settings: Settings, working_dir: Path) -> Settings:
+    """Replace game names by their appids and drop appids Steam does not know.
+
+    A name has to match a catalog entry exactly or with all of its words,
+    names that do not are skipped with a warning. Both need an imported
+    catalog, without one names are ignored and every appid is kept.
+    """
+    db = database.open_database(working_dir)
+    game_ids = list(settings.steam_game_ids)
+    for name in settings.steam_game_names:
+        # a guess from single words would watch an unrelated game
+        matches = db.search_steam_catalog(name, limit=1, any_word=False)
+        if not matches:
+            print(
+                f"no steam game found for {name!r}, check the name or import "
+                "the catalog first, --find-steam-game suggests similar ones"
+            )
+            continue
+        print(f"watching {matches[0].name} ({matches[0].appid}) for {name!r}")
+        if matches[0].appid not in game_ids:
+            game_ids.append(matches[0].appid)
+
+    unknown = set(db.unknown_steam_apps(game_ids))
+    if unknown:
+        print(
+            "ignoring steam appids missing from the catalog (refresh it with "
+            "--import-steam-catalog if they are new):",
+            ", ".join(str(appid) for appid in sorted(unknown)),
+        )
+    return replace(
+        settings,
+        steam_game_ids=tuple(i for i in game_ids if i not in unknown),
+    )
@@ -0,0 +1,75 @@
+"""The clock the notifier reads the time from.
+
+It is the system clock unless `set_clock` installs another one. A
+`VirtualClock` lets simulations run weeks of polling in seconds, waiting
+on it only moves its time forward.
+
+Durations like timeouts, circuit breakers and rate limits keep measuring
+real time with `time.monotonic`, they are about the network, not the
+calendar.
+"""
+
+from __future__ import annotations
+
+import threading
+import time as _time
+from datetime import datetime, timezone
+
+
+class Clock:
+    """The system clock."""
+
+    def time(self) -> float:
+        """Return the current unix timestamp in seconds."""
+        return _time.time()
+
+    def sleep(self, seconds: float) -> None:
+        """Block for `seconds`."""
+        _time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """A clock that only moves when it is slept on or advanced."""
+
+    def __init__(self, start: float):
+        """:param float start: unix timestamp the clock starts at"""
+        self._now = start
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        """Return the virtual unix timestamp."""
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        """Advance by `seconds` instead of waiting."""
+        self.advance(seconds)
+
+    def advance(self, seconds: float) -> None:
+        """Move the clock forward by `seconds`, never backwards."""
+        with self._lock:
+            self._now += max(0.0, seconds)
+
+
+_clock: Clock = Clock()
+
+
+def set_clock(clock: Clock) -> Clock:
+    """Install `clock` for the whole process and return the previous one."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def time() -> float:
+    """Return the current unix timestamp in seconds."""
+    return _clock.time()
+
+
+def now() -> datetime:
+    """Return the current time, timezone aware in UTC."""
+    return datetime.fromtimestamp(_clock.time(), timezone.utc)
+
+
+def sleep(seconds: float) -> None:
+    """Wait for `seconds`, instantly on a virtual clock."""
+    _clock.sleep(seconds)
@@ -0,0 +1,253 @@
+"""Settings read from a config directory's .env file."""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Callable, Mapping, Optional, TypeVar
+
+from game_notifier import catalog, database
+from game_notifier.models import PriceAlertRules, Region, SteamGameRule
+
+TNumber = TypeVar("TNumber", int, float)
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Everything read from a config directory's .env."""
+
+    topic: str
+    poll_interval: int  # minutes
+    epic_poll_interval: int  # minutes
+    steam_poll_interval: int  # minutes
+    notify_epic: bool = False
+    steam_game_ids: tuple[int, ...] = ()
+    # looked up in the steam catalog and added to steam_game_ids when loading
+    steam_game_names: tuple[str, ...] = ()
+    max_connections_per_host: int = 4
+    steam_requests_per_minute: float = 40  # 0 disables the limit
+    http_connect_timeout: float = 5.0  # seconds
+    http_read_timeout: float = 30.0  # seconds
+    http_max_retries: int = 3
+    # seconds one poll may spend on requests, 0 for no limit
+    poll_deadline: float = 300.0
+    ntfy_rate_limit: float = 12  # messages per minute and topic
+    delivery_concurrency: int = 4
+    # send the notifications of a topic as one message
+    ntfy_digest: bool = False
+    ntfy_digest_window: int = 60  # seconds to collect a digest
+    metrics_port: int = 0  # 0 disables the metrics endpoint
+    steam_alert_rules: PriceAlertRules = PriceAlertRules()
+    steam_game_rules: tuple[SteamGameRule, ...] = ()
+    region: Region = Region()
+
+
+# locale and language of the store pages per country, others fall back to english
+REGIONS = {
+    "AT": Region("AT", "de", "german"),
+    "DE": Region("DE", "de", "german"),
+    "CH": Region("CH", "de", "german"),
+    "FR": Region("FR", "fr", "french"),
+    "GB": Region("GB", "en-US", "english"),
+    "US": Region("US", "en-US", "english"),
+    "ES": Region("ES", "es-ES", "spanish"),
+    "IT": Region("IT", "it", "italian"),
+    "NL": Region("NL", "nl", "dutch"),
+    "PL": Region("PL", "pl", "polish"),
+}
+
+
+def _parse_bool(raw: str) -> bool:
+    return raw.lower() in ("true", "1", "yes")
+
+
+def _parse_games(raw: str) -> tuple[tuple[int, ...], tuple[str, ...]]:
+    """Split a comma separated list into appids and game names."""
+    ids: list[int] = []
+    names: list[str] = []
+    for entry in raw.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            ids.append(int(entry))
+        except ValueError:
+            names.append(entry)
+    return tuple(ids), tuple(names)
+
+
+def _parse_game_rule(entry: str) -> SteamGameRule:
+    """Parse e.g. `47890: max_price=9.99 min_discount=50 cooldown=14`."""
+    appid, _, raw_conditions = entry.partition(":")
+    conditions = dict(c.split("=", 1) for c in raw_conditions.split())
+    if not conditions:
+        raise ValueError("no conditions given")
+    unknown = set(conditions) - {"max_price", "min_discount", "cooldown"}
+    if unknown:
+        raise ValueError(f"unknown conditions {', '.join(sorted(unknown))}")
+    max_price = conditions.get("max_price")
+    min_discount = conditions.get("min_discount")
+    cooldown = conditions.get("cooldown")
+    return SteamGameRule(
+        appid=int(appid),
+        max_price=None if max_price is None else round(float(max_price) * 100),
+        min_discount=None if min_discount is None else int(min_discount),
+        cooldown=None if cooldown is None else int(float(cooldown) * 24 * 60 * 60),
+    )
+
+
+def _parse_game_rules(raw: str) -> tuple[SteamGameRule, ...]:
+    """Split a comma separated list of rules, one per steam game."""
+    rules: dict[int, SteamGameRule] = {}
+    for entry in raw.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            rule = _parse_game_rule(entry)
+        except ValueError as e:
+            raise ValueError(
+                f"invalid steam game rule {entry!r} (STEAM_GAME_RULES): {e}"
+            ) from e
+        rules[rule.appid] = rule
+    return tuple(rules.values())
+
+
+def _parse_region(raw: str) -> Region:
+    country = raw.strip().upper()
+    if len(country) != 2 or not country.isalpha():
+        raise ValueError(f"invalid store region {raw!r} (STORE_REGION)")
+    return REGIONS.get(country, Region(country, "en-US", "english"))
+
+
+def _parse_positive(raw: str, key: str, parse: Callable[[str], TNumber]) -> TNumber:
+    value = parse(raw)
+    # unlike other settings, 0 cannot mean "no limit" for these
+    if value <= 0:
+        raise ValueError(f"invalid value {raw!r}, has to be above 0 ({key})")
+    return value
+
+
+def parse_settings(values: Mapping[str, str | None]) -> Settings:
+    """Build settings from raw key/value pairs.
+
+    Raises:
+        ValueError: if a required value is missing or malformed
+
+    """
+
+    def get(key: str, default: str = "") -> str:
+        value = values.get(key)
+        return default if value is None else value
+
+    topic = get("NTFY_TOPIC")
+    if not topic:
+        raise ValueError("no topic set (NTFY_TOPIC)")
+    poll_interval = int(get("POLL_INTERVAL", "60"))
+    steam_game_ids, steam_game_names = _parse_games(get("STEAM_WANTED_GAMES"))
+    steam_game_rules = _parse_game_rules(get("STEAM_GAME_RULES"))
+    # a game with a rule is watched even if it is not in STEAM_WANTED_GAMES
+    steam_game_ids += tuple(
+        rule.appid for rule in steam_game_rules if rule.appid not in steam_game_ids
+    )
+
+    return Settings(
+        topic=topic,
+        poll_interval=poll_interval,
+        epic_poll_interval=int(get("EPIC_POLL_INTERVAL", str(poll_interval))),
+        steam_poll_interval=int(get("STEAM_POLL_INTERVAL", str(poll_interval))),
+        notify_epic=_parse_bool(get("EPIC_NOTIFY_FREE_GAMES")),
+        steam_game_ids=steam_game_ids,
+        steam_game_names=steam_game_names,
+        max_connections_per_host=_parse_positive(
+            get("MAX_CONNECTIONS_PER_HOST", "4"), "MAX_CONNECTIONS_PER_HOST", int
+        ),
+        steam_requests_per_minute=float(get("STEAM_REQUESTS_PER_MINUTE", "40")),
+        http_connect_timeout=float(get("HTTP_CONNECT_TIMEOUT", "5")),
+        http_read_timeout=float(get("HTTP_READ_TIMEOUT", "30")),
+        http_max_retries=int(get("HTTP_MAX_RETRIES", "3")),
+        poll_deadline=float(get("POLL_DEADLINE", "300")),
+        ntfy_rate_limit=_parse_positive(
+            get("NTFY_RATE_LIMIT", "12"), "NTFY_RATE_LIMIT", float
+        ),
+        delivery_concurrency=_parse_positive(
+            get("DELIVERY_CONCURRENCY", "4"), "DELIVERY_CONCURRENCY", int
+        ),
+        ntfy_digest=_parse_bool(get("NTFY_DIGEST")),
+        ntfy_digest_window=int(get("NTFY_DIGEST_WINDOW", "60")),
+        metrics_port=int(get("METRICS_PORT", "0")),
+        steam_alert_rules=PriceAlertRules(
+            all_time_low=_parse_bool(get("STEAM_NOTIFY_ALL_TIME_LOW")),
+            below_median_percent=int(get("STEAM_NOTIFY_BELOW_MEDIAN_PERCENT", "0")),
+        ),
+        steam_game_rules=steam_game_rules,
+        region=_parse_region(get("STORE_REGION", "DE")),
+    )
+
+
+def load_settings(config_dir: Path) -> Settings:
+    """Read the .env in `config_dir`, variables already set in the environment win.
+
+    Steam games are checked against the catalog in the directory's database,
+    which has to be initialized. The steam game rules are stored in it.
+    """
+    import dotenv
+
+    values = dict(dotenv.dotenv_values(config_dir / ".env"))
+    values.update(os.environ)
+    settings = catalog.resolve_steam_games(parse_settings(values), config_dir)
+    database.open_database(config_dir).set_steam_game_rules(settings.steam_game_rules)
+    return settings
+
+
+# settings that are shared by the whole process and only apply after a restart
+RESTART_REQUIRED = frozenset(
+    {
+        "max_connections_per_host",
+        "steam_requests_per_minute",
+        "http_connect_timeout",
+        "http_read_timeout",
+        "http_max_retries",
+        "poll_deadline",
+        "metrics_port",
+    }
+)
+
+
+def diff_settings(old: Settings, new: Settings) -> set[str]:
+    """Return the names of all settings that differ."""
+    return {
+        f.name for f in fields(Settings) if getattr(old, f.name) != getattr(new, f.name)
+    }
+
+
+class ConfigWatcher:
+    """Notice changes of a config directory's .env by its modification time."""
+
+    def __init__(self, config_dir: Path):
+        """Watch the .env in `config_dir`, starting from its current state."""
+        self.config_dir = config_dir
+        self._mtime = self._stat()
+
+    def _stat(self) -> Optional[int]:
+        try:
+            return (self.config_dir / ".env").stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def changed(self) -> bool:
+        """Check whether the .env changed since the last call."""
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        return True
+
+    def reload(self) -> Optional[Settings]:
+        """Parse the .env again, None if it is invalid."""
+        try:
+            return load_settings(self.config_dir)
+        except ValueError as e:
+            print(f"ignoring invalid config in {self.config_dir}: {e}")
+            return None
@@ -1,17 +1,663 @@
 """Basic data persistance."""
 
+from __future__ import annotations
+
+import json
+import re
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
+
+from game_notifier.models import (
+    EpicGame,
+    OutboxMessage,
+    PriceAlert,
+    SteamAppMeta,
+    SteamGameRule,
+)
+
+from . import metrics, utils
+
+if TYPE_CHECKING:
+    from game_notifier.sources.base import Notification
+
+DB_FILENAME = "data.db"
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    # with WAL, NORMAL only syncs on checkpoints and is still corruption-safe
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA cache_size=-8000;",  # 8 MiB
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA busy_timeout=5000;",
+)
+
+NOTIFICATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS Notifications (
+        source TEXT NOT NULL,
+        entry_key TEXT NOT NULL,
+        last_notified INTEGER,
+        PRIMARY KEY (source, entry_key)
+    );
+"""
+NOTIFICATIONS_INDEX = (
+    "CREATE INDEX IF NOT EXISTS NotificationsByTime "
+    "ON Notifications (source, last_notified);"
+)
+STEAM_APPS_TABLE = """
+    CREATE TABLE IF NOT EXISTS SteamApps (
+        appid INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        header_image TEXT NOT NULL,
+        fetched_at INTEGER NOT NULL
+    );
+"""
+# notifications waiting to be sent, each one covers one or more entries
+# which count as notified once it was sent successfully
+OUTBOX_TABLE = """
+    CREATE TABLE IF NOT EXISTS Outbox (
+        id INTEGER PRIMARY KEY,
+        topic TEXT NOT NULL,
+        message TEXT NOT NULL,
+        image_url TEXT NOT NULL DEFAULT '',
+        store_url TEXT NOT NULL DEFAULT '',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at INTEGER NOT NULL,
+        markdown INTEGER NOT NULL DEFAULT 0
+    );
+"""
+OUTBOX_ENTRIES_TABLE = """
+    CREATE TABLE IF NOT EXISTS OutboxEntries (
+        outbox_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        entry_key TEXT NOT NULL,
+        PRIMARY KEY (source, entry_key)
+    );
+"""
+OUTBOX_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS OutboxByTime ON Outbox (next_attempt_at);",
+    "CREATE INDEX IF NOT EXISTS OutboxEntriesById ON OutboxEntries (outbox_id);",
+)
+# one row per price change, unchanged prices are not stored again
+STEAM_PRICES_TABLE = """
+    CREATE TABLE IF NOT EXISTS SteamPrices (
+        appid INTEGER NOT NULL,
+        observed_at INTEGER NOT NULL,
+        final_cents INTEGER NOT NULL,
+        PRIMARY KEY (appid, observed_at)
+    ) WITHOUT ROWID;
+"""
+STEAM_PRICES_INDEX = (
+    "CREATE INDEX IF NOT EXISTS SteamPricesByPrice "
+    "ON SteamPrices (appid, final_cents);"
+)
+PRICE_MEDIAN_WINDOW = 90 * 24 * 60 * 60
+# small values that have to survive restarts, e.g. the last maintenance
+STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS State (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID;
+"""
+# when to notify about single steam games, mirrors STEAM_GAME_RULES
+STEAM_GAME_RULES_TABLE = """
+    CREATE TABLE IF NOT EXISTS SteamGameRules (
+        appid INTEGER PRIMARY KEY,
+        max_price INTEGER,
+        min_discount INTEGER,
+        cooldown INTEGER
+    ) WITHOUT ROWID;
+"""
+AUTO_VACUUM_INCREMENTAL = 2
+# seconds between pruning and compacting the database
+MAINTENANCE_INTERVAL = 24 * 60 * 60
+# every app Steam knows, imported from an app list to look up appids by name
+STEAM_CATALOG_TABLE = """
+    CREATE TABLE IF NOT EXISTS SteamCatalog (
+        appid INTEGER PRIMARY KEY,
+        name TEXT NOT NULL
+    );
+"""
+STEAM_CATALOG_INDEX = (
+    "CREATE INDEX IF NOT EXISTS SteamCatalogByName "
+    "ON SteamCatalog (name COLLATE NOCASE);"
+)
+# full text index over the names, kept in sync with SteamCatalog by triggers
+STEAM_CATALOG_SEARCH = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS SteamCatalogSearch USING fts5("
+    "name, content='SteamCatalog', content_rowid='appid', "
+    "tokenize='unicode61 remove_diacritics 2');"
+)
+STEAM_CATALOG_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS SteamCatalogInsert AFTER INSERT ON SteamCatalog "
+    "BEGIN INSERT INTO SteamCatalogSearch (rowid, name) "
+    "VALUES (new.appid, new.name); END;",
+    "CREATE TRIGGER IF NOT EXISTS SteamCatalogDelete AFTER DELETE ON SteamCatalog "
+    "BEGIN INSERT INTO SteamCatalogSearch (SteamCatalogSearch, rowid, name) "
+    "VALUES ('delete', old.appid, old.name); END;",
+    "CREATE TRIGGER IF NOT EXISTS SteamCatalogUpdate "
+    "AFTER UPDATE OF name ON SteamCatalog "
+    "BEGIN INSERT INTO SteamCatalogSearch (SteamCatalogSearch, rowid, name) "
+    "VALUES ('delete', old.appid, old.name); "
+    "INSERT INTO SteamCatalogSearch (rowid, name) VALUES (new.appid, new.name); END;",
+)
+
+# statements are kept as constants so sqlite3's statement cache reuses them
+GET_NOTIFICATION = (
+    "SELECT last_notified FROM Notifications WHERE source = ? AND entry_key = ?;"
+)
+SET_NOTIFICATION = (
+    "INSERT INTO Notifications (source, entry_key, last_notified) "
+    "VALUES (?, ?, ?) "
+    "ON CONFLICT(source, entry_key) DO UPDATE SET "
+    "last_notified = excluded.last_notified;"
+)
+# every key that was never notified or whose last notification is old enough
+# and that is not already waiting in the outbox
+DUE_KEYS = (
+    "SELECT k.value FROM json_each(?1) AS k "
+    "LEFT JOIN Notifications AS n ON n.source = ?2 AND n.entry_key = k.value "
+    "WHERE (n.last_notified IS NULL OR n.last_notified <= ?3) "
+    "AND NOT EXISTS (SELECT 1 FROM OutboxEntries AS o "
+    "WHERE o.source = ?2 AND o.entry_key = k.value);"
+)
+GET_STEAM_APPS = (
+    "SELECT a.appid, a.name, a.header_image FROM json_each(?) AS k "
+    "JOIN SteamApps AS a ON a.appid = k.value WHERE a.fetched_at > ?;"
+)
+SET_STEAM_APP = (
+    "INSERT OR REPLACE INTO SteamApps (appid, name, header_image, fetched_at) "
+    "VALUES (?, ?, ?, ?);"
+)
+ENQUEUE_OUTBOX = (
+    "INSERT INTO Outbox (topic, message, image_url, store_url, next_attempt_at) "
+    "VALUES (?, ?, ?, ?, ?);"
+)
+ENQUEUE_OUTBOX_ENTRY = (
+    "INSERT INTO OutboxEntries (outbox_id, source, entry_key) VALUES (?, ?, ?);"
+)
+OUTBOX_HAS_ENTRY = "SELECT 1 FROM OutboxEntries WHERE source = ? AND entry_key = ?;"
+DUE_OUTBOX = (
+    "SELECT id, topic, message, image_url, store_url, attempts, markdown "
+    "FROM Outbox "
+    "WHERE next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?;"
+)
+# the WHERE clause is required for an upsert from a SELECT
+COMPLETE_OUTBOX = (
+    "INSERT INTO Notifications (source, entry_key, last_notified) "
+    "SELECT source, entry_key, ?1 FROM OutboxEntries WHERE outbox_id = ?2 "
+    "ON CONFLICT(source, entry_key) DO UPDATE SET "
+    "last_notified = excluded.last_notified;"
+)
+LAST_PRICE = (
+    "SELECT final_cents FROM SteamPrices WHERE appid = ? "
+    "ORDER BY observed_at DESC LIMIT 1;"
+)
+LOWEST_PRICE = "SELECT MIN(final_cents) FROM SteamPrices WHERE appid = ?;"
+COUNT_PRICES_SINCE = (
+    "SELECT COUNT(*) FROM SteamPrices WHERE appid = ? AND observed_at >= ?;"
+)
+NTH_PRICE_SINCE = (
+    "SELECT final_cents FROM SteamPrices WHERE appid = ? AND observed_at >= ? "
+    "ORDER BY final_cents LIMIT 1 OFFSET ?;"
+)
+ADD_PRICE = (
+    "INSERT OR REPLACE INTO SteamPrices (appid, observed_at, final_cents) "
+    "VALUES (?, ?, ?);"
+)
+ALL_STEAM_CATALOG = "SELECT appid, name FROM SteamCatalog;"
+SET_STEAM_CATALOG = (
+    "INSERT INTO SteamCatalog (appid, name) VALUES (?, ?) "
+    "ON CONFLICT(appid) DO UPDATE SET name = excluded.name;"
+)
+HAS_STEAM_CATALOG = "SELECT EXISTS (SELECT 1 FROM SteamCatalog);"
+FIND_STEAM_CATALOG = (
+    "SELECT appid, name FROM SteamCatalog WHERE name = ? COLLATE NOCASE "
+    "ORDER BY appid LIMIT ?;"
+)
+# only the first candidates in appid order are ranked, common words would
+# otherwise rank a large part of the catalog
+SEARCH_STEAM_CATALOG = (
+    "SELECT rowid, name FROM ("
+    "SELECT rowid, name, rank FROM SteamCatalogSearch "
+    "WHERE SteamCatalogSearch MATCH ? LIMIT ?"
+    ") ORDER BY rank, length(name) LIMIT ?;"
+)
+SEARCH_CANDIDATES = 500
+# words in too many names to tell them apart, left out of longer queries
+SEARCH_STOP_WORDS = frozenset(
+    {"a", "an", "and", "the", "of", "in", "on", "to", "for", "edition"}
+)
+ALL_STEAM_GAME_RULES = (
+    "SELECT appid, max_price, min_discount, cooldown FROM SteamGameRules;"
+)
+DELETE_STEAM_GAME_RULES = "DELETE FROM SteamGameRules;"
+ADD_STEAM_GAME_RULE = (
+    "INSERT INTO SteamGameRules (appid, max_price, min_discount, cooldown) "
+    "VALUES (?, ?, ?, ?);"
+)
+UNKNOWN_STEAM_APPS = (
+    "SELECT k.value FROM json_each(?) AS k "
+    "WHERE NOT EXISTS (SELECT 1 FROM SteamCatalog WHERE appid = k.value);"
+)
+# games with more than one price, the latest of which is recent
+RECENT_PRICE_CHANGES = (
+    "SELECT p.appid FROM json_each(?) AS k "
+    "JOIN SteamPrices AS p ON p.appid = k.value "
+    "GROUP BY p.appid HAVING COUNT(*) > 1 AND MAX(p.observed_at) >= ? "
+    "ORDER BY MAX(p.observed_at) DESC;"
+)
+ADD_DIGEST = (
+    "INSERT INTO Outbox (topic, message, next_attempt_at, markdown) "
+    "VALUES (?, ?, ?, 1);"
+)
+MOVE_OUTBOX_ENTRIES = (
+    "UPDATE OutboxEntries SET outbox_id = ?1 "
+    "WHERE outbox_id IN (SELECT value FROM json_each(?2));"
+)
+DELETE_OUTBOX = "DELETE FROM Outbox WHERE id IN (SELECT value FROM json_each(?));"
+PRUNE_NOTIFICATIONS = (
+    "DELETE FROM Notifications WHERE source = ? AND last_notified < ?;"
+)
+GET_STATE = "SELECT value FROM State WHERE key = ?;"
+SET_STATE = "INSERT OR REPLACE INTO State (key, value) VALUES (?, ?);"
+RETRY_OUTBOX = "UPDATE Outbox SET attempts = ?, next_attempt_at = ? WHERE id = ?;"
+
+
+class Database:
+    """Long-lived connection to the database in a working directory.
+
+    The connection is shared between threads, every access is serialized.
+    Writes outside of `transaction()` are committed right away.
+    """
+
+    def __init__(self, path: Path):
+        """Open the database in the working directory `path`."""
+        self.path = path
+        self._conn = sqlite3.connect(
+            path.joinpath(DB_FILENAME),
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=128,
+        )
+        self._lock = threading.RLock()
+        self._depth = 0
+        for pragma in PRAGMAS:
+            self._conn.execute(pragma)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The shared connection, hold `transaction()` while using it."""
+        return self._conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Group all statements inside into a single transaction.
+
+        Nested calls join the outermost transaction.
+        """
+        with self._lock:
+            self._depth += 1
+            if self._depth == 1:
+                self._conn.execute("BEGIN IMMEDIATE;")
+            try:
+                yield self._conn
+            except BaseException:
+                if self._depth == 1:
+                    self._conn.execute("ROLLBACK;")
+                raise
+            else:
+                if self._depth == 1:
+                    self._conn.execute("COMMIT;")
+            finally:
+                self._depth -= 1
+
+    @metrics.timed(metrics.DB_DURATION, operation="get_notification")
+    def get_notification(self, source: str, key: str) -> Optional[int]:
+        """Get the last_notified timestamp of (source, key) or None."""
+        with self._lock:
+            row = self._conn.execute(GET_NOTIFICATION, (source, key)).fetchone()
+        return row[0] if row else None
+
+    @metrics.timed(metrics.DB_DURATION, operation="set_notification")
+    def set_notification(self, source: str, key: str, last_notified: int) -> None:
+        """Record when the entry `key` of `source` was notified."""
+        with self._lock:
+            self._conn.execute(SET_NOTIFICATION, (source, key, last_notified))
+
+    @metrics.timed(metrics.DB_DURATION, operation="due_keys")
+    def due_keys(
+        self,
+        source: str,
+        keys: Iterable[str],
+        cooldown: Optional[int],
+        now: Optional[int] = None,
+    ) -> set[str]:
+        """Return the keys that should be notified about, using a single query.
+
+        :param cooldown: seconds until a key is due again, None for never
+        """
+        if cooldown is None:
+            # only keys without any notification are due
+            cutoff = -1
+        else:
+            cutoff = (utils.timestamp_now() if now is None else now) - cooldown
+        with self._lock:
+            rows = self._conn.execute(
+                DUE_KEYS, (json.dumps(list(keys)), source, cutoff)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    @metrics.timed(metrics.DB_DURATION, operation="get_steam_apps")
+    def get_steam_apps(
+        self, appids: Iterable[int], max_age: int
+    ) -> dict[int, SteamAppMeta]:
+        """Return cached metadata of the given games not older than `max_age`."""
+        cutoff = utils.timestamp_now() - max_age
+        with self._lock:
+            rows = self._conn.execute(
+                GET_STEAM_APPS, (json.dumps(list(appids)), cutoff)
+            ).fetchall()
+        return {
+            appid: SteamAppMeta(appid=appid, name=name, header_image=header_image)
+            for appid, name, header_image in rows
+        }
+
+    @metrics.timed(metrics.DB_DURATION, operation="set_steam_apps")
+    def set_steam_apps(self, metas: Iterable[SteamAppMeta]) -> None:
+        """Store name and banner of steam games, they count as fetched now."""
+        now = utils.timestamp_now()
+        # autocommit would otherwise commit, and grow the WAL, once per row
+        with self.transaction():
+            self._conn.executemany(
+                SET_STEAM_APP,
+                ((m.appid, m.name, m.header_image, now) for m in metas),
+            )
+
+    @metrics.timed(metrics.DB_DURATION, operation="update_steam_catalog")
+    def update_steam_catalog(self, apps: Iterable[tuple[int, str]]) -> int:
+        """Add new apps and renames to the catalog, returns how many changed.
+
+        Unchanged apps are not written again, so refreshing from a newer app
+        list only touches the full text index for the differences.
+        """
+        with self.transaction():
+            known = dict(self._conn.execute(ALL_STEAM_CATALOG).fetchall())
+            changed = [(i, name) for i, name in apps if known.get(i) != name]
+            self._conn.executemany(SET_STEAM_CATALOG, changed)
+        return len(changed)
+
+    @metrics.timed(metrics.DB_DURATION, operation="search_steam_catalog")
+    def search_steam_catalog(
+        self, query: str, limit: int = 5, any_word: bool = True
+    ) -> list[SteamAppMeta]:
+        """Find apps by name, best matches first.
+
+        An exact (case-insensitive) name wins, otherwise every word has to
+        be in the name in any order, the last one may be incomplete. If that
+        finds nothing and `any_word` is set, a match of any word is good
+        enough. Stop words are ignored unless the query has nothing else.
+        """
+        words = re.findall(r"\w+", query.lower())
+        words = [w for w in words if w not in SEARCH_STOP_WORDS] or words
+        if not words:
+            return []
+        terms = [f'"{word}"' for word in words]
+        # short prefixes match too many names to rank them quickly
+        if len(words[-1]) >= 3:
+            terms[-1] += "*"
+        with self._lock:
+            rows = self._conn.execute(FIND_STEAM_CATALOG, (query, limit)).fetchall()
+            for operator in (" ", " OR ") if any_word else (" ",):
+                if rows:
+                    break
+                match = operator.join(terms)
+                rows = self._conn.execute(
+                    SEARCH_STEAM_CATALOG, (match, SEARCH_CANDIDATES, limit)
+                ).fetchall()
+        return [SteamAppMeta(appid=appid, name=name) for appid, name in rows]
+
+    @metrics.timed(metrics.DB_DURATION, operation="unknown_steam_apps")
+    def unknown_steam_apps(self, appids: Iterable[int]) -> list[int]:
+        """Return the appids missing from the catalog, none if it is empty."""
+        with self._lock:
+            if not self._conn.execute(HAS_STEAM_CATALOG).fetchone()[0]:
+                return []
+            rows = self._conn.execute(
+                UNKNOWN_STEAM_APPS, (json.dumps(list(appids)),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def steam_game_rules(self) -> dict[int, SteamGameRule]:
+        """Return every steam game rule by appid."""
+        with self._lock:
+            rows = self._conn.execute(ALL_STEAM_GAME_RULES).fetchall()
+        return {row[0]: SteamGameRule(*row) for row in rows}
+
+    @metrics.timed(metrics.DB_DURATION, operation="set_steam_game_rules")
+    def set_steam_game_rules(self, rules: Iterable[SteamGameRule]) -> bool:
+        """Replace all steam game rules, returns whether anything changed."""
+        by_appid = {rule.appid: rule for rule in rules}
+        with self.transaction() as conn:
+            if self.steam_game_rules() == by_appid:
+                return False
+            conn.execute(DELETE_STEAM_GAME_RULES)
+            conn.executemany(
+                ADD_STEAM_GAME_RULE,
+                (
+                    (r.appid, r.max_price, r.min_discount, r.cooldown)
+                    for r in by_appid.values()
+                ),
+            )
+        return True
+
+    def _price_alert(self, appid: int, cents: int, now: int) -> PriceAlert:
+        """Compare a new price with the stored history of a game.
+
+        The median is taken over the price changes of the window, it is not
+        weighted by how long each price lasted.
+        """
+        lowest = self._conn.execute(LOWEST_PRICE, (appid,)).fetchone()[0]
+        since = now - PRICE_MEDIAN_WINDOW
+        count = self._conn.execute(COUNT_PRICES_SINCE, (appid, since)).fetchone()[0]
+        below_median = 0
+        if count:
+            median = self._conn.execute(
+                NTH_PRICE_SINCE, (appid, since, count // 2)
+            ).fetchone()[0]
+            if median > 0 and cents < median:
+                below_median = (median - cents) * 100 // median
+        return PriceAlert(
+            all_time_low=lowest is not None and cents < lowest,
+            below_median_percent=below_median,
+        )
+
+    @metrics.timed(metrics.DB_DURATION, operation="record_steam_prices")
+    def record_steam_prices(self, prices: dict[int, int]) -> dict[int, PriceAlert]:
+        """Store changed prices (in cents) and return alerts for them.
+
+        Only games whose price changed and is a new all-time low or below
+        the median of the last 90 days get an alert. A game without history
+        never gets one.
+        """
+        now = utils.timestamp_now()
+        alerts: dict[int, PriceAlert] = {}
+        with self.transaction():
+            for appid, cents in prices.items():
+                last = self._conn.execute(LAST_PRICE, (appid,)).fetchone()
+                if last is not None and last[0] == cents:
+                    continue
+                if last is not None:
+                    alert = self._price_alert(appid, cents, now)
+                    if alert != PriceAlert():
+                        alerts[appid] = alert
+                self._conn.execute(ADD_PRICE, (appid, now, cents))
+        return alerts
+
+    @metrics.timed(metrics.DB_DURATION, operation="recent_price_changes")
+    def recent_price_changes(self, appids: Iterable[int], since: int) -> list[int]:
+        """Return the games whose price changed since `since`, latest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                RECENT_PRICE_CHANGES, (json.dumps(list(appids)), since)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    @metrics.timed(metrics.DB_DURATION, operation="enqueue")
+    def enqueue(
+        self, topic: str, notifications: Iterable[Notification], delay: int = 0
+    ) -> int:
+        """Put notifications into the outbox, returns how many were added.
+
+        Entries that are already waiting in the outbox, e.g. queued by an
+        overlapping poll, are skipped.
+
+        :param int delay: seconds until they are due, e.g. to collect a digest
+        """
+        due = utils.timestamp_now() + delay
+        count = 0
+        with self.transaction():
+            for n in notifications:
+                queued = self._conn.execute(OUTBOX_HAS_ENTRY, (n.source, n.key))
+                if queued.fetchone() is not None:
+                    continue
+                cursor = self._conn.execute(
+                    ENQUEUE_OUTBOX, (topic, n.message, n.image_url, n.store_url, due)
+                )
+                self._conn.execute(
+                    ENQUEUE_OUTBOX_ENTRY, (cursor.lastrowid, n.source, n.key)
+                )
+                count += 1
+        return count
+
+    @metrics.timed(metrics.DB_DURATION, operation="due_outbox")
+    def due_outbox(self, limit: int = 100) -> list[OutboxMessage]:
+        """Return outbox messages whose next attempt is due, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                DUE_OUTBOX, (utils.timestamp_now(), limit)
+            ).fetchall()
+        return [OutboxMessage(*row) for row in rows]
+
+    @metrics.timed(metrics.DB_DURATION, operation="next_outbox_attempt")
+    def next_outbox_attempt(self) -> Optional[int]:
+        """Return when the next outbox message is due, None if it is empty."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM Outbox;"
+            ).fetchone()
+        return row[0]
+
+    @metrics.timed(metrics.DB_DURATION, operation="complete_outbox")
+    def complete_outbox(self, outbox_id: int) -> None:
+        """Mark the entries of a sent message as notified and drop it."""
+        with self.transaction():
+            self._conn.execute(COMPLETE_OUTBOX, (utils.timestamp_now(), outbox_id))
+            self._conn.execute(
+                "DELETE FROM OutboxEntries WHERE outbox_id = ?;", (outbox_id,)
+            )
+            self._conn.execute("DELETE FROM Outbox WHERE id = ?;", (outbox_id,))
+
+    @metrics.timed(metrics.DB_DURATION, operation="discard_outbox")
+    def discard_outbox(self, outbox_id: int) -> None:
+        """Drop a message that can not be sent, its entries stay unnotified."""
+        with self.transaction():
+            self._conn.execute(
+                "DELETE FROM OutboxEntries WHERE outbox_id = ?;", (outbox_id,)
+            )
+            self._conn.execute("DELETE FROM Outbox WHERE id = ?;", (outbox_id,))
+
+    @metrics.timed(metrics.DB_DURATION, operation="merge_outbox")
+    def merge_outbox(self, outbox_ids: list[int], topic: str, message: str) -> int:
+        """Replace messages by a single markdown one that covers all their entries.
+
+        The new message is due right away, returns its id.
+        """
+        ids = json.dumps(outbox_ids)
+        with self.transaction():
+            cursor = self._conn.execute(
+                ADD_DIGEST, (topic, message, utils.timestamp_now())
+            )
+            self._conn.execute(MOVE_OUTBOX_ENTRIES, (cursor.lastrowid, ids))
+            self._conn.execute(DELETE_OUTBOX, (ids,))
+        return cursor.lastrowid
+
+    @metrics.timed(metrics.DB_DURATION, operation="retry_outbox")
+    def retry_outbox(self, outbox_id: int, attempts: int, next_attempt_at: int):
+        """Count a failed attempt and postpone the message to `next_attempt_at`."""
+        with self._lock:
+            self._conn.execute(RETRY_OUTBOX, (attempts, next_attempt_at, outbox_id))
+
+    @metrics.timed(metrics.DB_DURATION, operation="prune_notifications")
+    def prune_notifications(
+        self, retention: dict[str, int], now: Optional[int] = None
+    ) -> int:
+        """Delete entries notified longer ago than their source's retention.
+
+        :param retention: seconds to keep the entries of each source, sources
+            that are missing are kept forever
+        """
+        now = utils.timestamp_now() if now is None else now
+        with self.transaction():
+            before = self._conn.total_changes
+            self._conn.executemany(
+                PRUNE_NOTIFICATIONS,
+                ((source, now - keep) for source, keep in retention.items()),
+            )
+            return self._conn.total_changes - before
+
+    @metrics.timed(metrics.DB_DURATION, operation="compact")
+    def compact(self) -> None:
+        """Give free pages back to the file system and refresh statistics."""
+        with self._lock:
+            self._conn.execute("PRAGMA incremental_vacuum;")
+            # sampling keeps ANALYZE fast on the large catalog
+            self._conn.execute("PRAGMA analysis_limit = 1000;")
+            self._conn.execute("ANALYZE;")
+
+    def get_state(self, key: str) -> Optional[int]:
+        """Return the value stored under `key`, None if there is none."""
+        with self._lock:
+            row = self._conn.execute(GET_STATE, (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: int) -> None:
+        """Store `value` under `key`, replacing the previous one."""
+        with self._lock:
+            self._conn.execute(SET_STATE, (key, value))
+
+    def close(self) -> None:
+        """Close the connection, the object can not be used afterwards."""
+        with self._lock:
+            self._conn.close()
+
+
+_databases: dict[Path, Database] = {}
+_databases_lock = threading.Lock()
+
+
+def open_database(path: Path) -> Database:
+    """Return the shared database handle for a working directory."""
+    path = path.resolve()
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = Database(path)
+        return _databases[path]
 
-from game_notifier.models import EpicGame
 
-from . import utils
+def close_databases() -> None:
+    """Close every handle opened by `open_database`."""
+    with _databases_lock:
+        for db in _databases.values():
+            db.close()
+        _databases.clear()
 
 
 def get_db_connection(path: Path) -> sqlite3.Connection:
     """Get DB connection for use in with statement."""
-    return sqlite3.connect(path.joinpath("data.db"))
+    return sqlite3.connect(path.joinpath(DB_FILENAME))
 
 
 def _table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
@@ -26,29 +672,22 @@ def sqlite_get_notification(path: Path, source: str, key: str) -> Optional[str]:
     Returns:
         last_notified (YYYY-MM-DD) or None if not present.
     """
-    with get_db_connection(path) as conn:
-        cursor = conn.cursor()
-        query = (
-            "SELECT last_notified FROM Notifications "
-            "WHERE source = ? AND entry_key = ?;"
-        )
-        row = cursor.execute(query, (source, key)).fetchone()
-        return row[0] if row else None
+    last_notified = open_database(path).get_notification(source, key)
+    if last_notified is None:
+        return None
+    return utils.timestamp_to_date(last_notified)
 
 
 def sqlite_set_notification(
     path: Path, source: str, key: str, last_notified: str
 ) -> None:
-    """Insert or update a (source, key) notification entry."""
-    with get_db_connection(path) as conn:
-        cursor = conn.cursor()
-        query = (
-            "INSERT INTO Notifications (source, entry_key, last_notified) "
-            "VALUES (?, ?, ?) "
-            "ON CONFLICT(source, entry_key) DO UPDATE SET "
-            "last_notified = excluded.last_notified;"
-        )
-        cursor.execute(query, (source, key, last_notified))
+    """Insert or update a (source, key) notification entry.
+
+    :param str last_notified: date in the format YYYY-MM-DD
+    """
+    open_database(path).set_notification(
+        source, key, utils.date_to_timestamp(last_notified)
+    )
 
 
 def sqlite_get_steam_game(path: Path, game_id: int):
@@ -99,6 +738,25 @@ def sqlite_set_epic_entry(path: Path, game: EpicGame, date_notified: str):
     )
 
 
+def maintain(path: Path, retention: dict[str, int]) -> bool:
+    """Prune old notifications and compact the database once a day.
+
+    Safe to call often, returns whether anything was done.
+
+    :param retention: seconds to keep notified entries per source
+    """
+    db = open_database(path)
+    now = utils.timestamp_now()
+    last = db.get_state("last_maintenance") or 0
+    if now - last < MAINTENANCE_INTERVAL:
+        return False
+    pruned = db.prune_notifications(retention, now)
+    db.compact()
+    db.set_state("last_maintenance", now)
+    print(f"maintenance of {path.name}: pruned {pruned} old notifications")
+    return True
+
+
 def _migrate_legacy_tables(conn: sqlite3.Connection) -> None:
     """Best-effort migration from legacy tables into Notifications."""
     cursor = conn.cursor()
@@ -108,11 +766,8 @@ def _migrate_legacy_tables(conn: sqlite3.Connection) -> None:
             "SELECT game_id, last_notified FROM SteamSale;"
         ).fetchall():
             cursor.execute(
-                "INSERT INTO Notifications (source, entry_key, last_notified) "
-                "VALUES (?, ?, ?) "
-                "ON CONFLICT(source, entry_key) DO UPDATE SET "
-                "last_notified = excluded.last_notified;",
-                ("steam", str(game_id), last_notified),
+                SET_NOTIFICATION,
+                ("steam", str(game_id), utils.date_to_timestamp(last_notified)),
             )
 
     if _table_exists(conn, "EpicNotification"):
@@ -120,14 +775,44 @@ def _migrate_legacy_tables(conn: sqlite3.Connection) -> None:
             "SELECT title, date_notified FROM EpicNotification;"
         ).fetchall():
             cursor.execute(
-                "INSERT INTO Notifications (source, entry_key, last_notified) "
-                "VALUES (?, ?, ?) "
-                "ON CONFLICT(source, entry_key) DO UPDATE SET "
-                "last_notified = excluded.last_notified;",
-                ("epic", title, date_notified),
+                SET_NOTIFICATION,
+                ("epic", title, utils.date_to_timestamp(date_notified)),
             )
 
 
+def _migrate_outbox_markdown(conn: sqlite3.Connection) -> None:
+    """Add the markdown flag to outboxes created before digests existed."""
+    columns = conn.execute("PRAGMA table_info(Outbox);").fetchall()
+    if not any(col[1] == "markdown" for col in columns):
+        conn.execute(
+            "ALTER TABLE Outbox ADD COLUMN markdown INTEGER NOT NULL DEFAULT 0;"
+        )
+
+
+def _migrate_text_dates(conn: sqlite3.Connection) -> None:
+    """Convert last_notified from YYYY-MM-DD text to unix timestamps.
+
+    The column has to be recreated, a TEXT column would store the integers
+    as text again.
+    """
+    cursor = conn.cursor()
+    columns = cursor.execute("PRAGMA table_info(Notifications);").fetchall()
+    if not any(col[1] == "last_notified" and col[2] == "TEXT" for col in columns):
+        return
+
+    cursor.execute("ALTER TABLE Notifications RENAME TO Notifications_text;")
+    cursor.execute(NOTIFICATIONS_TABLE)
+    # dates were stored in local time, 'utc' converts them before strftime
+    cursor.execute(
+        "INSERT INTO Notifications (source, entry_key, last_notified) "
+        "SELECT source, entry_key, "
+        "CAST(strftime('%s', last_notified, 'utc') AS INTEGER) "
+        "FROM Notifications_text;"
+    )
+    cursor.execute("DROP TABLE Notifications_text;")
+    print("SETUP: migrated notification dates to timestamps")
+
+
 def _drop_legacy_tables(conn: sqlite3.Connection) -> None:
     """Remove legacy tables after migration (best-effort)."""
     cursor = conn.cursor()
@@ -137,24 +822,77 @@ def _drop_legacy_tables(conn: sqlite3.Connection) -> None:
         cursor.execute("DROP TABLE EpicNotification;")
 
 
+def _migrate_to_1(conn: sqlite3.Connection) -> None:
+    """Create every table, converting what unversioned databases left behind.
+
+    Version 0 is any database from before `user_version` was used, so the
+    legacy tables have to be looked up.
+    """
+    cursor = conn.cursor()
+    cursor.execute(NOTIFICATIONS_TABLE)
+    _migrate_text_dates(conn)
+    _migrate_legacy_tables(conn)
+    _drop_legacy_tables(conn)
+    cursor.execute(NOTIFICATIONS_INDEX)
+    cursor.execute(STEAM_APPS_TABLE)
+    cursor.execute(STEAM_PRICES_TABLE)
+    cursor.execute(STEAM_PRICES_INDEX)
+    cursor.execute(STEAM_CATALOG_TABLE)
+    cursor.execute(STEAM_CATALOG_INDEX)
+    cursor.execute(STEAM_CATALOG_SEARCH)
+    for trigger in STEAM_CATALOG_TRIGGERS:
+        cursor.execute(trigger)
+    cursor.execute(OUTBOX_TABLE)
+    cursor.execute(OUTBOX_ENTRIES_TABLE)
+    for index in OUTBOX_INDEXES:
+        cursor.execute(index)
+
+
+def _migrate_to_2(conn: sqlite3.Connection) -> None:
+    # an outbox created by _migrate_to_1 already has the column
+    _migrate_outbox_markdown(conn)
+
+
+def _migrate_to_3(conn: sqlite3.Connection) -> None:
+    conn.execute(STATE_TABLE)
+
+
+def _migrate_to_4(conn: sqlite3.Connection) -> None:
+    conn.execute(STEAM_GAME_RULES_TABLE)
+
+
+# MIGRATIONS[n] upgrades a database from version n to n + 1, the version is
+# stored as user_version. Append new steps, never change released ones.
+MIGRATIONS = (_migrate_to_1, _migrate_to_2, _migrate_to_3, _migrate_to_4)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+
+@metrics.timed(metrics.DB_DURATION, operation="init")
 def init_sqlite_db(path: Path):
-    """Initialize database.
+    """Initialize database or migrate it to the current schema.
+
+    Does nothing if the schema is current, which keeps short runs fast.
 
     :param Path path: A path to users working directory WITHOUT the filename.
     """
-    with get_db_connection(path) as conn:
-        cursor = conn.cursor()
-
-        notifications_table = """
-            CREATE TABLE IF NOT EXISTS Notifications (
-                source TEXT NOT NULL,
-                entry_key TEXT NOT NULL,
-                last_notified TEXT,
-                PRIMARY KEY (source, entry_key)
-            );
-        """
-        cursor.execute(notifications_table)
-
-        _migrate_legacy_tables(conn)
-        _drop_legacy_tables(conn)
-    print("SETUP: database initialized")
+    db = open_database(path)
+    if _schema_version(db.connection) >= SCHEMA_VERSION:
+        return
+    with db.transaction() as conn:
+        # another process might have migrated it in the meantime
+        version = _schema_version(conn)
+        for migrate in MIGRATIONS[version:]:
+            migrate(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+
+    with db._lock:
+        conn = db.connection
+        if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            # only takes effect after a full VACUUM, outside of any transaction
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            conn.execute("VACUUM;")
+    print(f"SETUP: database migrated from schema {version} to {SCHEMA_VERSION}")
@@ -0,0 +1,96 @@
+"""Background delivery of the notification outbox."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, Optional
+
+from game_notifier import database, notifier
+from game_notifier.models import OutboxMessage
+
+
+class TopicRateLimiter:
+    """Space out messages to the same topic to at most `rate` per minute."""
+
+    def __init__(self, rate: float):
+        """Allow `rate` messages per minute and topic."""
+        self._interval = 60 / rate
+        self._next_slot: dict[str, float] = {}
+
+    async def wait(self, topic: str) -> None:
+        """Wait for the next free slot of `topic`."""
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(topic, now))
+        self._next_slot[topic] = slot + self._interval
+        await asyncio.sleep(slot - now)
+
+
+async def _wait_any(*aws: Awaitable, timeout: Optional[float] = None) -> None:
+    tasks = {asyncio.ensure_future(aw) for aw in aws}
+    _, pending = await asyncio.wait(
+        tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+    )
+    for task in pending:
+        task.cancel()
+
+
+class DeliveryWorker:
+    """Drain the outbox with bounded concurrency and a rate limit per topic."""
+
+    def __init__(
+        self,
+        db: database.Database,
+        concurrency: int,
+        rate_limit: float,
+        digest: bool = False,
+    ):
+        """Create the worker, see `configure` for the limits."""
+        self._db = db
+        self.configure(concurrency, rate_limit, digest)
+        # set after new messages were put into the outbox
+        self.wakeup = asyncio.Event()
+
+    def configure(
+        self, concurrency: int, rate_limit: float, digest: bool = False
+    ) -> None:
+        """Change the limits, messages already being sent keep the old ones.
+
+        With `digest`, due messages of a topic are merged before sending.
+        """
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._rate_limiter = TopicRateLimiter(rate_limit)
+        self._digest = digest
+
+    async def _deliver(self, message: OutboxMessage) -> None:
+        await self._rate_limiter.wait(message.topic)
+        async with self._semaphore:
+            print("sending notification:", message.message)
+            await asyncio.to_thread(notifier.deliver_message, self._db, message)
+
+    async def drain(self) -> int:
+        """Try to send every due message once, returns how many were tried."""
+        if self._digest:
+            await asyncio.to_thread(notifier.digest_outbox, self._db)
+        messages = await asyncio.to_thread(self._db.due_outbox)
+        await asyncio.gather(*(self._deliver(m) for m in messages))
+        return len(messages)
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Deliver until `stop` is set, unsent messages stay in the outbox."""
+        while not stop.is_set():
+            self.wakeup.clear()
+            drain = asyncio.create_task(self.drain())
+            await _wait_any(drain, stop.wait())
+            if not drain.done():
+                drain.cancel()
+                break
+            if drain.result():
+                # more messages might be due than one drain picks up
+                continue
+
+            next_attempt = await asyncio.to_thread(self._db.next_outbox_attempt)
+            timeout = None
+            if next_attempt is not None:
+                timeout = max(0, next_attempt - time.time())
+            await _wait_any(stop.wait(), self.wakeup.wait(), timeout=timeout)
@@ -0,0 +1,470 @@
+"""Concurrent polling engine built on asyncio.
+
+Runs every source at the same time, limits concurrent requests per host and
+delivers the outbox while other sources are still being fetched. Each source
+is polled on its own schedule.
+
+Several config directories can be served at once, each game is only fetched
+once per store region and the results are handed to every tenant of that
+region that wants it.
+
+Changes to a tenant's .env are picked up while running, either on SIGHUP or
+when its modification time changes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import signal
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+from game_notifier import database, http_client, metrics
+from game_notifier.config import (
+    RESTART_REQUIRED,
+    ConfigWatcher,
+    Settings,
+    diff_settings,
+)
+from game_notifier.delivery import DeliveryWorker
+from game_notifier.models import Region, SteamGameRule
+from game_notifier.notifier import build_sources
+from game_notifier.scheduler import Scheduler
+from game_notifier.sources.base import GameStoreSource, retention_seconds
+
+# seconds between checks whether a .env was changed
+CONFIG_CHECK_INTERVAL = 30
+# seconds between checks whether the databases are due for maintenance
+MAINTENANCE_CHECK_INTERVAL = 60 * 60
+
+
+class HostLimiter:
+    """Hand out one semaphore per host to cap concurrent requests."""
+
+    def __init__(self, per_host: int):
+        """Allow `per_host` concurrent requests to every host."""
+        self._per_host = per_host
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def __call__(self, host: str) -> asyncio.Semaphore:
+        """Return the semaphore of `host`, created on first use."""
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self._per_host)
+        return self._semaphores[host]
+
+
+@dataclass
+class Tenant:
+    """One config directory with its own sources, database and topic."""
+
+    working_dir: Path
+    settings: Settings
+    sources: dict[str, GameStoreSource] = field(default_factory=dict)
+    worker: Optional[DeliveryWorker] = None
+    # hold back notifications for NTFY_DIGEST_WINDOW to collect a digest,
+    # not needed when everything is sent at the end of a single cycle
+    collect_digest: bool = True
+
+    def __post_init__(self):
+        """Build the sources right away."""
+        self.build_sources()
+
+    def build_sources(self) -> None:
+        """Create the sources from the current settings."""
+        self.sources = {
+            source.name: source
+            for source in build_sources(
+                self.settings.notify_epic,
+                list(self.settings.steam_game_ids),
+                self.working_dir,
+                self.settings.steam_alert_rules,
+                self.settings.region,
+            )
+        }
+
+
+def _intervals(settings: Settings) -> dict[str, timedelta]:
+    return {
+        "epic": timedelta(minutes=settings.epic_poll_interval),
+        "steam": timedelta(minutes=settings.steam_poll_interval),
+    }
+
+
+def source_key(source: GameStoreSource) -> str:
+    """Name a shared source by its store and region."""
+    return f"{source.name}:{source.region.country}"
+
+
+def _price_targets(tenants: list[Tenant]) -> list[SteamGameRule]:
+    """Merge the target prices of the tenants, the highest one wins.
+
+    The shared fetch only needs them to keep games that are not discounted,
+    each tenant checks its own rules afterwards.
+    """
+    targets: dict[int, int] = {}
+    for tenant in tenants:
+        for rule in tenant.settings.steam_game_rules:
+            if rule.max_price is not None:
+                targets[rule.appid] = max(rule.max_price, targets.get(rule.appid, 0))
+    return [SteamGameRule(appid, max_price=price) for appid, price in targets.items()]
+
+
+def build_shared_sources(
+    tenants: list[Tenant], rolling: bool = False
+) -> tuple[dict[str, GameStoreSource], dict[str, timedelta]]:
+    """Plan the fetches of all tenants so nothing is requested twice.
+
+    Tenants of the same region share one source per store, which fetches the
+    union of their games. Another region only adds the requests for its own
+    games, e.g. its Steam batches. With `rolling`, large Steam watchlists are
+    checked one batch at a time spread over their interval.
+
+    Returns:
+        tuple of (sources by key, interval by key), a source is polled as
+        often as the tenant with the shortest interval wants it
+
+    """
+    by_region: dict[Region, list[Tenant]] = {}
+    for tenant in tenants:
+        by_region.setdefault(tenant.settings.region, []).append(tenant)
+
+    sources: dict[str, GameStoreSource] = {}
+    intervals: dict[str, timedelta] = {}
+    for region, members in by_region.items():
+        notify_epic = any(t.settings.notify_epic for t in members)
+        steam_ids = sorted({i for t in members for i in t.settings.steam_game_ids})
+        # metadata and price history recorded while fetching are shared as
+        # well, keep them with the first tenant so currencies never mix
+        for source in build_sources(
+            notify_epic,
+            steam_ids,
+            members[0].working_dir,
+            region=region,
+            rolling_steam=rolling,
+            steam_game_rules=_price_targets(members),
+        ):
+            key = source_key(source)
+            sources[key] = source
+            for tenant in members:
+                if source.name in tenant.sources:
+                    interval = _intervals(tenant.settings)[source.name]
+                    intervals[key] = min(interval, intervals.get(key, interval))
+    return sources, intervals
+
+
+def _receives(tenant: Tenant, source: GameStoreSource) -> bool:
+    return source.name in tenant.sources and tenant.settings.region == source.region
+
+
+async def _fan_out(tenant: Tenant, name: str, items: list) -> None:
+    """Queue the notifications of one tenant for already fetched items."""
+    source = tenant.sources.get(name)
+    if source is None:
+        # removed by a config reload while fetching
+        return
+    wanted = [item for item in items if source.wants(item)]
+    notifications = await asyncio.to_thread(
+        source.select, tenant.working_dir, wanted
+    )
+    for notification in notifications:
+        print(
+            f"queueing notification for {name} ({tenant.working_dir.name}):",
+            notification.message,
+        )
+    settings = tenant.settings
+    delay = 0
+    if settings.ntfy_digest and tenant.collect_digest:
+        delay = settings.ntfy_digest_window
+    db = database.open_database(tenant.working_dir)
+    if await asyncio.to_thread(db.enqueue, settings.topic, notifications, delay):
+        assert tenant.worker is not None
+        tenant.worker.wakeup.set()
+
+
+async def _poll_source(
+    source: GameStoreSource, tenants: list[Tenant], limiter: HostLimiter
+):
+    with metrics.POLL_DURATION.time(source=source.name):
+        try:
+            # threads started inside inherit the deadline
+            with http_client.deadline():
+                items = await source.fetch_async(limiter)
+            await asyncio.gather(
+                *(
+                    _fan_out(t, source.name, items)
+                    for t in tenants
+                    if _receives(t, source)
+                )
+            )
+        except Exception:
+            metrics.POLL_ERRORS.inc(source=source.name)
+            raise
+    metrics.LAST_SUCCESS.set(time.time(), source=source.name)
+
+
+async def _poll_and_reschedule(
+    source: GameStoreSource,
+    interval: timedelta,
+    tenants: list[Tenant],
+    limiter: HostLimiter,
+    scheduler: Scheduler,
+):
+    try:
+        await _poll_source(source, tenants, limiter)
+    except Exception as e:
+        print(f"polling {source.name} failed:", repr(e))
+    finally:
+        next_poll = source.next_poll(datetime.now(timezone.utc), interval)
+        scheduler.schedule(source_key(source), next_poll.timestamp())
+        print(
+            f"{source_key(source)} done, next check at",
+            next_poll.astimezone().strftime("%Y-%m-%d %H:%M:%S"),
+        )
+
+
+async def _poll_added(
+    source: GameStoreSource, tenants: list[Tenant], limiter: HostLimiter
+):
+    try:
+        await _poll_source(source, tenants, limiter)
+    except Exception as e:
+        print("checking new steam games failed:", repr(e))
+
+
+def _setup(
+    configs: list[tuple[Path, Settings]],
+    stop: asyncio.Event,
+    collect_digest: bool = True,
+) -> tuple[list[Tenant], HostLimiter, list[asyncio.Task]]:
+    """Create the tenants and start their delivery workers."""
+    tenants = [
+        Tenant(working_dir, settings, collect_digest=collect_digest)
+        for working_dir, settings in configs
+    ]
+    delivering: list[asyncio.Task] = []
+    for tenant in tenants:
+        tenant.worker = DeliveryWorker(
+            database.open_database(tenant.working_dir),
+            tenant.settings.delivery_concurrency,
+            tenant.settings.ntfy_rate_limit,
+            tenant.settings.ntfy_digest,
+        )
+        delivering.append(asyncio.create_task(tenant.worker.run(stop)))
+    # process wide limits come from the first tenant
+    limiter = HostLimiter(tenants[0].settings.max_connections_per_host)
+    return tenants, limiter, delivering
+
+
+def _reload_tenant(tenant: Tenant, settings: Settings) -> bool:
+    """Apply new settings to a tenant, True if its sources changed."""
+    changed = diff_settings(tenant.settings, settings)
+    if not changed:
+        return False
+    print(
+        f"reloading config of {tenant.working_dir.name}:", ", ".join(sorted(changed))
+    )
+    needs_restart = changed & RESTART_REQUIRED
+    if needs_restart:
+        print("a restart is needed to apply", ", ".join(sorted(needs_restart)))
+    # the topic is read from the settings whenever notifications are queued
+    tenant.settings = settings
+    if changed & {
+        "notify_epic",
+        "steam_game_ids",
+        "steam_alert_rules",
+        "steam_game_rules",
+    }:
+        tenant.build_sources()
+    if changed & {"delivery_concurrency", "ntfy_rate_limit", "ntfy_digest"}:
+        assert tenant.worker is not None
+        tenant.worker.configure(
+            settings.delivery_concurrency,
+            settings.ntfy_rate_limit,
+            settings.ntfy_digest,
+        )
+    return True
+
+
+def _reload_shared(
+    tenants: list[Tenant],
+    sources: dict[str, GameStoreSource],
+    intervals: dict[str, timedelta],
+    scheduler: Scheduler,
+) -> list[GameStoreSource]:
+    """Bring the shared sources in line with the tenants' settings.
+
+    Sources keep their state, new ones are polled right away and removed
+    ones are dropped from the schedule.
+
+    Returns:
+        sources for the Steam games that were not checked before and still
+        have to be fetched once
+
+    """
+    from game_notifier.sources.steam import SteamSource
+
+    new_sources, new_intervals = build_shared_sources(tenants, rolling=True)
+    now = time.time()
+    added: list[GameStoreSource] = []
+    for key in list(sources):
+        if key not in new_sources:
+            print(f"{key} is not needed anymore")
+            del sources[key]
+    for key, source in new_sources.items():
+        current = sources.get(key)
+        if current is None:
+            sources[key] = source
+            scheduler.schedule(key, now)
+        elif isinstance(current, SteamSource) and isinstance(source, SteamSource):
+            current.set_rules(source.rules)
+            added_ids = current.set_wanted_game_ids(source.wanted_game_ids)
+            if added_ids:
+                print(f"checking {len(added_ids)} new games of {key}")
+                added.append(current.subset(added_ids))
+
+    for name, interval in new_intervals.items():
+        # a shorter interval should not wait for the old next check
+        due_at = scheduler.due_at(name)
+        if due_at is not None and due_at > now + interval.total_seconds():
+            scheduler.schedule(name, now + interval.total_seconds())
+    intervals.clear()
+    intervals.update(new_intervals)
+    return added
+
+
+async def _maintain(tenants: list[Tenant]) -> None:
+    """Prune and compact each tenant's database if it is due.
+
+    The shared response cache is pruned along with them.
+    """
+    maintained = False
+    for tenant in tenants:
+        retention = retention_seconds(tenant.sources.values())
+        try:
+            maintained |= await asyncio.to_thread(
+                database.maintain, tenant.working_dir, retention
+            )
+        except Exception as e:
+            print(f"maintenance of {tenant.working_dir} failed:", repr(e))
+    if maintained:
+        pruned = await asyncio.to_thread(http_client.prune_cache)
+        print(f"pruned {pruned} old cached responses")
+
+
+async def run(configs: list[tuple[Path, Settings]]):
+    """Poll all sources whenever they are due until SIGTERM or SIGINT.
+
+    Each (working directory, settings) pair is served as its own tenant, but
+    games wanted by several tenants are fetched only once.
+    """
+    stop = asyncio.Event()
+    reload_requested = asyncio.Event()
+    event_loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        event_loop.add_signal_handler(sig, stop.set)
+    event_loop.add_signal_handler(signal.SIGHUP, reload_requested.set)
+
+    tenants, limiter, delivering = _setup(configs, stop)
+    sources, intervals = build_shared_sources(tenants, rolling=True)
+    watchers = [ConfigWatcher(tenant.working_dir) for tenant in tenants]
+    next_config_check = time.time() + CONFIG_CHECK_INTERVAL
+    next_maintenance = time.time()
+
+    scheduler = Scheduler()
+    for name in sources:
+        scheduler.schedule(name, time.time())
+    running: set[asyncio.Task] = set()
+
+    def start(coro) -> None:
+        task = asyncio.create_task(coro)
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    try:
+        while not stop.is_set():
+            if reload_requested.is_set() or time.time() >= next_config_check:
+                forced = reload_requested.is_set()
+                reload_requested.clear()
+                next_config_check = time.time() + CONFIG_CHECK_INTERVAL
+                reloaded = False
+                for tenant, watcher in zip(tenants, watchers, strict=True):
+                    if watcher.changed() or forced:
+                        settings = watcher.reload()
+                        if settings is not None:
+                            reloaded |= _reload_tenant(tenant, settings)
+                if reloaded:
+                    # only the new games, the rest stays on its schedule
+                    for added in _reload_shared(tenants, sources, intervals, scheduler):
+                        start(_poll_added(added, tenants, limiter))
+
+            if time.time() >= next_maintenance:
+                next_maintenance = time.time() + MAINTENANCE_CHECK_INTERVAL
+                start(_maintain(tenants))
+
+            for name in scheduler.pop_due(time.time()):
+                if name in sources:
+                    start(
+                        _poll_and_reschedule(
+                            sources[name], intervals[name], tenants, limiter, scheduler
+                        )
+                    )
+
+            # wake up for the next due source, a config check, maintenance,
+            # a finished poll or a stop
+            next_wakeup = min(
+                scheduler.next_due() or math.inf, next_config_check, next_maintenance
+            )
+            timeout = max(0, next_wakeup - time.time())
+            waiters = {
+                asyncio.create_task(stop.wait()),
+                asyncio.create_task(reload_requested.wait()),
+                *running,
+            }
+            _, waiting = await asyncio.wait(
+                waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            for waiter in waiting - running:
+                waiter.cancel()
+    finally:
+        for task in running:
+            task.cancel()
+        stop.set()
+        # messages that were not sent yet stay in the outbox for the next start
+        await asyncio.gather(*delivering)
+        print("engine stopped")
+
+
+async def run_once(configs: list[tuple[Path, Settings]]):
+    """Poll every source once and send everything that is due, then return."""
+    stop = asyncio.Event()
+    stop.set()
+    tenants, limiter, _ = _setup(configs, stop, collect_digest=False)
+    sources, _ = build_shared_sources(tenants)
+
+    results = await asyncio.gather(
+        *(_poll_source(source, tenants, limiter) for source in sources.values()),
+        return_exceptions=True,
+    )
+    for name, result in zip(sources, results, strict=True):
+        if isinstance(result, BaseException):
+            print(f"polling {name} failed:", repr(result))
+    for tenant in tenants:
+        assert tenant.worker is not None
+        # one drain only picks up a limited number of messages
+        while await tenant.worker.drain():
+            pass
+    await _maintain(tenants)
+
+
+def loop(configs: list[tuple[Path, Settings]]):
+    """Blocking entry point of the engine."""
+    asyncio.run(run(configs))
+
+
+def once(configs: list[tuple[Path, Settings]]):
+    """Blocking entry point for a single cycle."""
+    asyncio.run(run_once(configs))
@@ -1,41 +1,71 @@
 """Interacts with external APIs to retrieve data about games."""
 
-from datetime import datetime, timezone
-from typing import Optional
+import json
+from datetime import datetime
+from typing import Any, Callable, Optional
 import requests
 
-from game_notifier.models import EpicGame, SteamSaleHit
+from game_notifier import clock, http_client
+from game_notifier.models import (
+    DEFAULT_REGION,
+    EpicCandidate,
+    EpicGame,
+    PriceAlert,
+    Region,
+    SteamAppMeta,
+    SteamSaleHit,
+)
 
-# TODO: allow for configuration
-# hard-coded values for games available in Germany
-LOCALE = "de"
-LANGUAGE = "german"
-COUNTRY = "DE"
-ALLOW_COUNTRIES = "DE"
+EPIC_HOST = "store-site-backend-static-ipv4.ak.epicgames.com"
+EPIC_PROMOTIONS_URL = f"https://{EPIC_HOST}/freeGamesPromotions"
+STEAM_HOST = "store.steampowered.com"
+STEAM_APPDETAILS_URL = f"https://{STEAM_HOST}/api/appdetails"
+STEAM_APP_LIST_URL = "https://api.steampowered.com/ISteamApps/GetAppList/v2/"
+# appdetails only accepts several appids at once with `filters=price_overview`
+STEAM_BATCH_SIZE = 100
+# appdetails allows about 200 requests in 5 minutes
+STEAM_REQUESTS_PER_MINUTE = 40
+# slots of every rolling request for games whose price changed lately
+STEAM_HOT_SLOTS = 25
+STEAM_HOT_WINDOW = 7 * 24 * 60 * 60
 
+# seconds a cached response is used without asking the server again
+# the promotions change about once a week
+EPIC_CACHE_TTL = 15 * 60
+# a promotion is only polled after it started or ended plus this many seconds
+EPIC_BOUNDARY_GRACE = 60
+STEAM_PRICE_CACHE_TTL = 0
+# name and banner of a steam game are only looked up again after this long
+STEAM_METADATA_TTL = 30 * 24 * 60 * 60
+# how old the last good data may be to stand in while a store is unavailable,
+# whether an Epic game is free is decided from the promotion dates anyway
+EPIC_STALE_MAX_AGE = 7 * 24 * 60 * 60
+STEAM_STALE_MAX_AGE = 6 * 60 * 60
+
+# an element of the promotions document as sent by Epic
 EpicResponseGame = dict
+# returns name and banner for the given appids, leaving out unknown ones
+SteamMetaLookup = Callable[[list[int]], dict[int, SteamAppMeta]]
+# gets every price_overview of a batch, returns alerts for some of the appids
+SteamPriceObserver = Callable[[dict[int, dict]], dict[int, PriceAlert]]
+# returns earlier price_overviews of a batch while Steam is unavailable
+SteamStalePrices = Callable[[list[int]], dict[int, dict]]
 
 
-def epic_is_currently_free(game: EpicResponseGame) -> bool:
-    """Inspect a single game and determines whether it is free right now."""
-    # most games that are no longer free have this field set to `None`
-    promo = game.get("promotions", {})
-    if not promo:
-        return False
+def epic_is_currently_free(game: EpicCandidate, now: datetime) -> bool:
+    """Determine whether a game is free at `now`."""
+    return game.discount_price == 0 and any(
+        start <= now <= end for start, end in game.discount_windows
+    )
+
+
+def _parse_epic_date(raw: str) -> datetime:
+    return datetime.fromisoformat(raw.replace("Z", "+00:00"))
 
-    offers = promo.get("promotionalOffers") or []
-    for block in offers:
-        for offer in block.get("promotionalOffers", []):
-            if offer.get("discountSetting", {}).get("discountType") == "PERCENTAGE":
-                start = datetime.fromisoformat(
-                    offer["startDate"].replace("Z", "+00:00")
-                )
-                end = datetime.fromisoformat(offer["endDate"].replace("Z", "+00:00"))
-                now = datetime.now(timezone.utc)
-                price = game.get("price", {}).get("totalPrice", {}).get("discountPrice")
-                if price == 0 and start <= now <= end:
-                    return True
-    return False
+
+def epic_promotion_boundaries(games: list[EpicCandidate]) -> list[datetime]:
+    """Return every start and end of current and upcoming promotions, sorted."""
+    return sorted({boundary for game in games for boundary in game.boundaries})
 
 
 def epic_get_banner_url(game: EpicResponseGame) -> str:
@@ -44,71 +74,328 @@ def epic_get_banner_url(game: EpicResponseGame) -> str:
     Returns an empty string if none is found.
     """
     wanted_image_types = ["OfferImageWide"]
-    for image_obj in game.get("keyImages", []):
+    for image_obj in game.get("keyImages") or []:
         if image_obj.get("type") in wanted_image_types:
             return image_obj.get("url", "")
 
     return ""
 
 
-def epic_build_store_url(game: EpicResponseGame) -> str:
+def _epic_page_slug(game: EpicResponseGame) -> str:
+    offer_mappings: list | None = game.get("offerMappings")
+    if offer_mappings and len(offer_mappings) > 0:
+        return offer_mappings[0].get("pageSlug") or ""
+    return ""
+
+
+def epic_build_store_url(game: EpicCandidate, region: Region = DEFAULT_REGION) -> str:
     """Determine the page URL of an epicgames game.
 
     Returns an empty string if none is found.
     """
-    offer_mappings: list | None = game.get("offerMappings")
-    if offer_mappings and len(offer_mappings) > 0:
-        slug = offer_mappings[0].get("pageSlug")
-        if slug:
-            return f"https://epicgames.com/{LOCALE}/p/{slug}"
+    if game.page_slug:
+        return f"https://epicgames.com/{region.locale}/p/{game.page_slug}"
     return ""
 
 
-def epic_free_games() -> list[EpicGame]:
-    """Return a list of the games that are currently free on epicgames."""
+def epic_candidate(game: EpicResponseGame) -> EpicCandidate:
+    """Keep only what is needed of a promotions element, dates are parsed once."""
+    promo = game.get("promotions") or {}
+    windows = []
+    boundaries = set()
+    for key in ("promotionalOffers", "upcomingPromotionalOffers"):
+        for block in promo.get(key) or []:
+            for offer in block.get("promotionalOffers") or []:
+                start, end = offer.get("startDate"), offer.get("endDate")
+                for raw in (start, end):
+                    if raw:
+                        boundaries.add(_parse_epic_date(raw))
+                discount = (offer.get("discountSetting") or {}).get("discountType")
+                current = key == "promotionalOffers"
+                if current and start and end and discount == "PERCENTAGE":
+                    windows.append((_parse_epic_date(start), _parse_epic_date(end)))
+    price = ((game.get("price") or {}).get("totalPrice") or {}).get("discountPrice")
+    return EpicCandidate(
+        title=game.get("title") or "",
+        discount_price=price,
+        discount_windows=tuple(windows),
+        boundaries=tuple(sorted(boundaries)),
+        banner_url=epic_get_banner_url(game),
+        page_slug=_epic_page_slug(game),
+    )
+
+
+def _epic_object_hook(obj: dict) -> Any:
+    # called for every object as soon as it is decoded, so the full element
+    # with all its images, categories and attributes is dropped right away
+    if "promotions" in obj and "title" in obj:
+        return epic_candidate(obj)
+    return obj
+
+
+def parse_epic_promotions(body: bytes) -> list[EpicCandidate]:
+    """Read the games of a promotions document, keeping only the used fields.
+
+    Raises ValueError if it is not a promotions document.
+    """
+    document = json.loads(body, object_hook=_epic_object_hook)
+    try:
+        elements = document["data"]["Catalog"]["searchStore"]["elements"]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"unexpected Epic promotions response: {e!r}") from e
+    if not isinstance(elements, list):
+        raise ValueError("unexpected Epic promotions response: no list of games")
+    return [
+        game if isinstance(game, EpicCandidate) else epic_candidate(game)
+        for game in elements
+        if isinstance(game, (dict, EpicCandidate))
+    ]
+
+
+def epic_games(
+    ttl: float = EPIC_CACHE_TTL, region: Region = DEFAULT_REGION
+) -> list[EpicCandidate]:
+    """Return all games of the promotions document, free or not.
+
+    Unchanged documents are not parsed again.
+
+    :param float ttl: seconds a cached document is used without revalidation
+    """
+    return http_client.get_json(
+        f"{EPIC_PROMOTIONS_URL}?locale={region.locale}"
+        f"&country={region.country}&allowCountries={region.country}",
+        ttl=ttl,
+        loads=parse_epic_promotions,
+    )
+
+
+def epic_free_games(
+    games: Optional[list[EpicCandidate]] = None,
+    region: Region = DEFAULT_REGION,
+    now: Optional[datetime] = None,
+) -> list[EpicGame]:
+    """Return a list of the games that are currently free on epicgames.
+
+    Fetches the promotions unless `games` from `epic_games` is given.
+
+    :param datetime now: the time to check the promotions against, one
+        value for the whole cycle
+    """
     free_games: list[EpicGame] = []
 
-    with requests.get(
-        "https://store-site-backend-static-ipv4.ak.epicgames.com/freeGamesPromotions?"
-        f"locale={LOCALE}&country={COUNTRY}&allowCountries={ALLOW_COUNTRIES}"
-    ) as response:
-        games: list[EpicResponseGame] = response.json()["data"]["Catalog"][
-            "searchStore"
-        ]["elements"]
-        for game in games:
-            if epic_is_currently_free(game):
-                banner = epic_get_banner_url(game)
-                url = epic_build_store_url(game)
-                free_games.append(
-                    EpicGame(title=game["title"], banner_url=banner, store_url=url)
+    if games is None:
+        games = epic_games(region=region)
+    if now is None:
+        now = clock.now()
+    for game in games:
+        if game.title and epic_is_currently_free(game, now):
+            free_games.append(
+                EpicGame(
+                    title=game.title,
+                    banner_url=game.banner_url,
+                    store_url=epic_build_store_url(game, region),
                 )
+            )
 
     return free_games
 
 
 # https://github.com/Revadike/InternalSteamWebAPI/wiki/Get-App-Details
-# TODO: handle if f2p game is provided - price_overview will be missing then
-def steam_sale(appid: int) -> Optional[SteamSaleHit]:
+def steam_sale(
+    appid: int, region: Region = DEFAULT_REGION
+) -> Optional[SteamSaleHit]:
     """Return a message composed for a given steam game's appid in case it is on sale.
 
+    Games without a price, like free to play or unknown ones, are never on sale.
+
     :param int appid: valid Steam appid
     """
-    message = ""
+    game_info = steam_app_details(appid, region) or {}
+    game_price_info = game_info.get("price_overview") or {}
+    if game_price_info.get("discount_percent", 0) > 0:
+        return SteamSaleHit(
+            title=game_info.get("name", ""),
+            appid=appid,
+            discount_percentage=game_price_info["discount_percent"],
+            banner_url=game_info.get("header_image", ""),
+            price=game_price_info.get("final_formatted", ""),
+            final_cents=game_price_info.get("final", 0),
+        )
+    return None
+
+
+def steam_store_url(appid: int) -> str:
+    """Return the store page of a steam game."""
+    return f"https://{STEAM_HOST}/app/{appid}"
+
+
+def steam_app_details(appid: int, region: Region = DEFAULT_REGION) -> Optional[dict]:
+    """Return the full appdetails `data` object of a steam game.
 
-    with requests.get(
-        "https://store.steampowered.com/api/appdetails?"
-        f"appids={appid}&cc={LOCALE}&l={LANGUAGE}"
+    Returns None if Steam does not know the appid.
+    """
+    with http_client.get(
+        f"{STEAM_APPDETAILS_URL}?appids={appid}"
+        f"&cc={region.country}&l={region.language}",
+        expect_json=True,
     ) as response:
-        game_info = response.json()[str(appid)]["data"]
-        game_price_info = game_info["price_overview"]
+        response.raise_for_status()
+        body = http_client.decode_json(response)
+    if not isinstance(body, dict):
+        raise ValueError(f"unexpected appdetails response for {appid}")
+    entry = body.get(str(appid)) or {}
+    if not entry.get("success") or not isinstance(entry.get("data"), dict):
+        return None
+    return entry["data"]
+
 
-        if game_price_info["discount_percent"] > 0:
-            steam_game = SteamSaleHit(
-                title=game_info["name"],
+def steam_app_metas(
+    appids: list[int], region: Region = DEFAULT_REGION
+) -> dict[int, SteamAppMeta]:
+    """Look up name and banner of each given steam game, one request per game."""
+    metas: dict[int, SteamAppMeta] = {}
+    for appid in appids:
+        details = steam_app_details(appid, region)
+        if details is not None:
+            metas[appid] = SteamAppMeta(
                 appid=appid,
-                discount_percentage=game_price_info["discount_percent"],
-                banner_url=game_info["header_image"],
-                price=game_price_info["final_formatted"],
+                name=details.get("name", ""),
+                header_image=details.get("header_image", ""),
             )
+    return metas
+
+
+def steam_app_list(url: str = STEAM_APP_LIST_URL) -> list[tuple[int, str]]:
+    """Return (appid, name) of every app on Steam, a single large response."""
+    with http_client.get(url, expect_json=True) as response:
+        response.raise_for_status()
+        body = http_client.decode_json(response)
+    return parse_steam_app_list(body)
+
+
+def parse_steam_app_list(body: dict) -> list[tuple[int, str]]:
+    """Read an app list as returned by `GetAppList`, apps without name are left out."""
+    return [
+        (int(app["appid"]), app["name"].strip())
+        for app in body["applist"]["apps"]
+        if app.get("name", "").strip()
+    ]
+
+
+def steam_prices(
+    appids: list[int], region: Region = DEFAULT_REGION, cache: bool = True
+) -> dict[int, dict]:
+    """Return the `price_overview` of many steam games using a single request.
+
+    Games without a price (e.g. free to play or unknown appids) are left out.
+    Raises ValueError if the response as a whole can not be interpreted.
+
+    :param bool cache: False for batches that are unlikely to be requested
+        again in the same composition
+    """
+    joined = ",".join(str(appid) for appid in appids)
+    body: dict = http_client.get_json(
+        f"{STEAM_APPDETAILS_URL}?appids={joined}&filters=price_overview"
+        f"&cc={region.country}&l={region.language}",
+        ttl=STEAM_PRICE_CACHE_TTL,
+        cache=cache,
+    )
+
+    if not isinstance(body, dict):
+        raise ValueError("unexpected appdetails response")
+    prices: dict[int, dict] = {}
+    for appid in appids:
+        entry = body.get(str(appid)) or {}
+        # the filtered `data` is an empty list if there is no price_overview
+        data = entry.get("data") if entry.get("success") else None
+        if isinstance(data, dict) and "discount_percent" in data.get(
+            "price_overview", {}
+        ):
+            prices[appid] = data["price_overview"]
+    return prices
+
+
+def steam_sales(
+    appids: list[int],
+    batch_size: int = STEAM_BATCH_SIZE,
+    lookup_meta: SteamMetaLookup = steam_app_metas,
+    observe: Optional[SteamPriceObserver] = None,
+    region: Region = DEFAULT_REGION,
+    stale: Optional[SteamStalePrices] = None,
+    cache: bool = True,
+) -> list[SteamSaleHit]:
+    """Return all given steam games that are currently on sale.
+
+    Prices are requested in batches of `batch_size` appids. Only if a whole
+    batch fails for reasons of its own, like a malformed body, its games are
+    requested one by one using `steam_sale`.
+    The price-only requests drop name and banner, those are taken from
+    `lookup_meta` for discounted games.
+    Every batch of prices is passed to `observe`, games it raises an alert
+    for are returned even if they are not discounted.
+    While Steam is unavailable, timing out or answering with 429 or a 5xx,
+    batches use the earlier prices from `stale`.
+    Without `cache` the price requests bypass the response cache.
+    """
+    hits: list[SteamSaleHit] = []
+    for start in range(0, len(appids), batch_size):
+        batch = appids[start : start + batch_size]
+        alerts: dict[int, PriceAlert] = {}
+        try:
+            prices = steam_prices(batch, region, cache)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            if not http_client.is_host_failure(e):
+                print(f"batched Steam lookup failed ({e!r}), falling back per game")
+                hits.extend(_steam_sales_one_by_one(batch, region))
+                continue
+            # asking per game would only hit the failing host more often
+            prices = stale(batch) if stale else {}
+            print(f"Steam is unavailable ({e}), using {len(prices)} earlier prices")
+        else:
+            alerts = observe(prices) if observe else {}
+
+        discounted = {
+            appid: price_info
+            for appid, price_info in prices.items()
+            if price_info["discount_percent"] > 0 or appid in alerts
+        }
+        if not discounted:
+            continue
+        try:
+            metas = lookup_meta(list(discounted))
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Steam details lookup failed: {e!r}")
+            metas = {}
+        for appid, price_info in discounted.items():
+            meta = metas.get(appid, SteamAppMeta(appid=appid))
+            hits.append(
+                SteamSaleHit(
+                    title=meta.name,
+                    appid=appid,
+                    discount_percentage=price_info["discount_percent"],
+                    banner_url=meta.header_image,
+                    price=price_info.get("final_formatted", ""),
+                    final_cents=price_info.get("final", 0),
+                    alert=alerts.get(appid, PriceAlert()),
+                )
+            )
+    return hits
+
 
-            return steam_game
+def _steam_sales_one_by_one(
+    appids: list[int], region: Region
+) -> list[SteamSaleHit]:
+    hits: list[SteamSaleHit] = []
+    for appid in appids:
+        try:
+            sale_hit = steam_sale(appid, region)
+        except http_client.Unavailable as e:
+            # the remaining games would not be asked either
+            print(f"Steam lookups stopped: {e}")
+            break
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Steam lookup for {appid} failed: {e!r}")
+            continue
+        if sale_hit:
+            hits.append(sale_hit)
+    return hits
@@ -0,0 +1,489 @@
+"""Shared HTTP session for every outgoing request.
+
+Keeps connections alive per host, applies timeouts and retries 429/5xx
+responses with exponential backoff and jitter.
+
+A host that keeps failing is not asked again for a while (circuit breaker),
+and a poll can set a deadline after which no further requests are sent.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from game_notifier import clock, metrics
+from game_notifier.response_cache import CachedResponse, ResponseCache
+
+CONNECT_TIMEOUT = 5.0  # seconds
+READ_TIMEOUT = 30.0  # seconds
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5  # waits 0.5s, 1s, 2s, ... between retries
+POOL_MAXSIZE = 4  # kept-alive connections per host
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+USER_AGENT = "game-notifier/0.1"
+# consecutive failures after which a host is not asked for a while
+BREAKER_THRESHOLD = 5
+# seconds until the first probe, doubled after every failed probe
+BREAKER_BASE_DELAY = 30.0
+BREAKER_MAX_DELAY = 30 * 60.0
+# seconds a single poll may spend on requests, 0 for no limit
+POLL_DEADLINE = 300.0
+# cached responses not fetched for this long are removed by `prune_cache`
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+class Unavailable(requests.ConnectionError):
+    """A request was not sent at all, retrying it right away is pointless."""
+
+
+class CircuitOpen(Unavailable):
+    """The circuit breaker of the host is open."""
+
+
+class DeadlineExceeded(Unavailable):
+    """The deadline of the current poll passed before the request."""
+
+
+class CircuitBreaker:
+    """Stop asking a host after repeated failures, then probe it with backoff.
+
+    While open every request fails immediately. Once the delay has passed a
+    single request is let through, if it succeeds the circuit closes again,
+    otherwise it stays open for twice as long.
+    """
+
+    def __init__(
+        self,
+        threshold: int = BREAKER_THRESHOLD,
+        base_delay: float = BREAKER_BASE_DELAY,
+        max_delay: float = BREAKER_MAX_DELAY,
+    ):
+        """Open after `threshold` failures, then back off up to `max_delay`."""
+        self._threshold = threshold
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._failures = 0
+        self._delay = base_delay
+        self._open_until: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """Check whether requests to the host are currently refused."""
+        return self._open_until is not None
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now, a probe counts as sent."""
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if self._probing or time.monotonic() < self._open_until:
+                return False
+            self._probing = True
+            return True
+
+    def cancel(self) -> None:
+        """Give back a probe that was allowed but never sent."""
+        with self._lock:
+            self._probing = False
+
+    def success(self) -> None:
+        """Close the circuit after a request succeeded."""
+        with self._lock:
+            self._failures = 0
+            self._delay = self._base_delay
+            self._open_until = None
+            self._probing = False
+
+    def failure(self) -> None:
+        """Count a failed request, opening the circuit after too many."""
+        with self._lock:
+            self._failures += 1
+            if self._probing:
+                self._delay = min(self._delay * 2, self._max_delay)
+            elif self._failures < self._threshold:
+                return
+            self._probing = False
+            # jitter keeps several processes from probing at the same time
+            delay = self._delay * random.uniform(0.9, 1.1)
+            self._open_until = time.monotonic() + delay
+
+
+class TokenBucket:
+    """Allow `rate` requests per minute on average, at most `burst` at once.
+
+    Callers reserve a token even if none is left and sleep until it would
+    have been refilled, so concurrent callers are spaced out evenly.
+    """
+
+    def __init__(self, rate: float, burst: float = 1):
+        """Create a full bucket."""
+        self._per_second = rate / 60
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """Wait for a token, returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._burst, self._tokens + (now - self._updated) * self._per_second
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self._per_second)
+        time.sleep(wait)
+        return wait
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_cache = ResponseCache()
+# request budget per host, hosts without one are not limited
+_buckets: dict[str, TokenBucket] = {}
+# decoded JSON GETs that are running right now, identical ones wait for them
+_in_flight: dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+# monotonic time after which the current poll sends no more requests
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+def configure(
+    connect_timeout: Optional[float] = None,
+    read_timeout: Optional[float] = None,
+    max_retries: Optional[int] = None,
+    pool_maxsize: Optional[int] = None,
+    cache_dir: Optional[Path] = None,
+    poll_deadline: Optional[float] = None,
+):
+    """Override the defaults. Takes effect for the next created session.
+
+    Cached responses are only kept in memory unless `cache_dir` is given.
+    """
+    global CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES, POOL_MAXSIZE, POLL_DEADLINE
+    global _cache
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+    if max_retries is not None:
+        MAX_RETRIES = max_retries
+    if pool_maxsize is not None:
+        POOL_MAXSIZE = pool_maxsize
+    if cache_dir is not None:
+        _cache = ResponseCache(cache_dir)
+    if poll_deadline is not None:
+        POLL_DEADLINE = poll_deadline
+    close()
+
+
+def set_rate_limit(host: str, per_minute: float) -> None:
+    """Limit the requests to `host` to `per_minute`, 0 removes the limit."""
+    if per_minute > 0:
+        _buckets[host] = TokenBucket(per_minute)
+    else:
+        _buckets.pop(host, None)
+
+
+def breaker(host: str) -> CircuitBreaker:
+    """Return the circuit breaker of `host`, creating it on first use."""
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+def is_host_failure(error: BaseException) -> bool:
+    """Check whether `error` means the host is failing, not the request.
+
+    These are the failures the circuit breaker counts: the host could not be
+    reached, timed out or answered with 429 or a 5xx.
+    """
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status >= 500 or status == 429
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def _record(host: str, ok: bool) -> None:
+    host_breaker = breaker(host)
+    if ok:
+        host_breaker.success()
+    else:
+        host_breaker.failure()
+    metrics.HTTP_CIRCUIT_OPEN.set(int(host_breaker.is_open), host=host)
+
+
+@contextmanager
+def deadline(seconds: Optional[float] = None) -> Iterator[None]:
+    """Fail requests with `DeadlineExceeded` once `seconds` have passed.
+
+    Covers everything started inside, including threads started with
+    `asyncio.to_thread`. Defaults to `POLL_DEADLINE`, 0 means no limit.
+    """
+    seconds = POLL_DEADLINE if seconds is None else seconds
+    token = _deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _remaining(host: str) -> Optional[float]:
+    """Return the seconds left for the current poll, raise if there are none."""
+    until = _deadline.get()
+    if until is None:
+        return None
+    remaining = until - time.monotonic()
+    if remaining <= 0:
+        metrics.HTTP_REJECTED.inc(host=host, reason="deadline")
+        raise DeadlineExceeded(f"deadline of the poll passed before asking {host}")
+    return remaining
+
+
+class _Retry(Retry):
+    """Retry idempotent requests on any failure, POSTs only if not delivered.
+
+    A POST is retried after connection errors, it was never sent then, and
+    after a 429 with Retry-After, the server refused it. After a read
+    timeout or a 5xx the message may already be out, a retry would send it
+    twice.
+    """
+
+    def is_retry(
+        self, method: str, status_code: int, has_retry_after: bool = False
+    ) -> bool:
+        if method.upper() == "POST":
+            return bool(self.total and status_code == 429 and has_retry_after)
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_session() -> requests.Session:
+    retry = _Retry(
+        total=MAX_RETRIES,
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=BACKOFF_FACTOR,
+        backoff_jitter=BACKOFF_FACTOR,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def session() -> requests.Session:
+    """Return the shared session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+
+def close():
+    """Close all pooled connections."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def request(
+    method: str, url: str, expect_json: bool = False, **kwargs
+) -> requests.Response:
+    """Send a request through the shared session and record metrics.
+
+    Raises `Unavailable` without sending anything if the circuit of the host
+    is open or the deadline of the current poll has passed. With
+    `expect_json` a 2xx response only counts as success for the circuit once
+    `decode_json` could read it.
+    """
+    host = urlparse(url).netloc
+    _remaining(host)
+    if not breaker(host).allow():
+        metrics.HTTP_REJECTED.inc(host=host, reason="circuit_open")
+        raise CircuitOpen(f"{host} failed repeatedly, not asking it for now")
+    bucket = _buckets.get(host)
+    if bucket is not None:
+        metrics.HTTP_THROTTLED.inc(bucket.take(), host=host)
+    try:
+        remaining = _remaining(host)
+    except DeadlineExceeded:
+        breaker(host).cancel()
+        raise
+    timeout = kwargs.pop("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    if remaining is not None:
+        timeout = (min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining))
+    with metrics.HTTP_DURATION.time(host=host, method=method):
+        try:
+            response = session().request(method, url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            metrics.HTTP_ERRORS.inc(host=host, method=method)
+            _record(host, ok=False)
+            raise
+    status = response.status_code
+    if status >= 500 or status == 429:
+        _record(host, ok=False)
+    elif not (expect_json and 200 <= status < 300):
+        _record(host, ok=True)
+    metrics.HTTP_REQUESTS.inc(
+        host=host, method=method, status=str(response.status_code)
+    )
+    return response
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """Send a GET request through the shared session."""
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """Send a POST request through the shared session."""
+    return request("POST", url, **kwargs)
+
+
+def _decode(
+    host: str, body: bytes, loads: Callable[[bytes], Any] = json.loads
+) -> Any:
+    try:
+        parsed = loads(body)
+    except ValueError:
+        # an error page with status 200 means the host is not well
+        _record(host, ok=False)
+        raise
+    _record(host, ok=True)
+    return parsed
+
+
+def decode_json(response: requests.Response) -> Any:
+    """Decode a JSON body, an undecodable one counts as a failure of the host.
+
+    Meant for responses requested with `expect_json`.
+    """
+    return _decode(urlparse(response.url).netloc, response.content)
+
+
+def get_cached(
+    url: str, ttl: float = 0, loads: Optional[Callable[[bytes], Any]] = None
+) -> tuple[CachedResponse, bool]:
+    """Send a conditional GET request using the response cache.
+
+    Entries younger than `ttl` seconds are returned without any request.
+    Otherwise ETag and Last-Modified of the cached entry are sent along.
+    With `loads` a changed body is decoded into `parsed` before it is
+    cached, one that cannot be decoded raises and is not cached.
+
+    Returns:
+        tuple of (response, changed) where `changed` is False if the cached
+        body was reused
+
+    """
+    entry = _cache.get(url)
+    now = clock.time()
+    if entry is not None and now - entry.fetched_at < ttl:
+        return entry, False
+
+    headers = {}
+    if entry is not None and entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry is not None and entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+
+    with get(url, headers=headers, expect_json=True) as response:
+        if entry is not None and response.status_code == 304:
+            entry.fetched_at = now
+            _cache.put(entry, body_changed=False)
+            return entry, False
+        response.raise_for_status()
+        entry = CachedResponse(
+            url=url,
+            body=response.content,
+            etag=response.headers.get("ETag", ""),
+            last_modified=response.headers.get("Last-Modified", ""),
+            fetched_at=now,
+        )
+    if loads is not None:
+        # an error page with status 200 would be served for the whole ttl
+        entry.parsed = _decode(urlparse(url).netloc, entry.body, loads)
+    # without validators or a ttl the entry could never be used again
+    if ttl > 0 or entry.etag or entry.last_modified:
+        _cache.put(entry)
+    return entry, True
+
+
+def prune_cache(max_age: float = CACHE_MAX_AGE) -> int:
+    """Remove cached responses older than `max_age` seconds, returns how many."""
+    return _cache.prune(clock.time() - max_age)
+
+
+def get_json(
+    url: str,
+    ttl: float = 0,
+    loads: Callable[[bytes], Any] = json.loads,
+    cache: bool = True,
+) -> Any:
+    """Return the decoded JSON body of `url`, see `get_cached`.
+
+    Unchanged bodies are not decoded again, the returned object is shared
+    between calls and must not be modified. Calls for a URL that is already
+    being requested wait for that request instead of sending their own.
+
+    :param loads: decodes the body, has to be the same for every call with
+        this URL as the result is cached
+    :param bool cache: False for URLs that are unlikely to be requested
+        again, they would only fill the response cache
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(url)
+        leading = future is None
+        if future is None:
+            future = _in_flight[url] = Future()
+    if not leading:
+        metrics.HTTP_COALESCED.inc(host=urlparse(url).netloc)
+        return future.result()
+
+    try:
+        if cache:
+            entry, _ = get_cached(url, ttl, loads)
+            if entry.parsed is None:
+                # read from disk, no request was made for it to count
+                entry.parsed = loads(entry.body)
+            parsed = entry.parsed
+        else:
+            with get(url, expect_json=True) as response:
+                response.raise_for_status()
+                parsed = _decode(urlparse(url).netloc, response.content, loads)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(parsed)
+        return parsed
+    finally:
+        with _in_flight_lock:
+            del _in_flight[url]
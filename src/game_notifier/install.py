@@ -6,6 +6,8 @@ from pathlib import Path
 SERVICE_DIR = Path.home() / '.config' / 'systemd' / 'user'
 TEMPLATE_NAME = 'game-notifier@.service'
 SERVICE_PATH = SERVICE_DIR / TEMPLATE_NAME
+ONCE_SERVICE_PATH = SERVICE_DIR / 'game-notifier-once@.service'
+TIMER_PATH = SERVICE_DIR / 'game-notifier-once@.timer'
 
 SERVICE_TEMPLATE = """\
 [Unit]
@@ -17,6 +19,7 @@ Type=simple
 Environment="PATH={path_env}"
 WorkingDirectory={cwd}
 ExecStart=/usr/bin/env python3 -u {main_py} --run --config-dir {cwd}
+ExecReload=/bin/kill -HUP $MAINPID
 StandardOutput=journal+console
 StandardError=inherit
 Restart=on-failure
@@ -26,6 +29,40 @@ RestartSec=15
 WantedBy=default.target
 """
 
+# runs a single cycle, started by the timer below
+ONCE_SERVICE_TEMPLATE = """\
+[Unit]
+Description=Gaming Notifier single run %I
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+Type=oneshot
+Environment="PATH={path_env}"
+WorkingDirectory={cwd}
+ExecStart=/usr/bin/env python3 -u {main_py} --run --once --config-dir {cwd}
+StandardOutput=journal+console
+StandardError=inherit
+"""
+
+TIMER_TEMPLATE = """\
+[Unit]
+Description=Run Gaming Notifier %I periodically
+
+[Timer]
+OnBootSec=2min
+# the interval is set per instance in a drop-in
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+"""
+
+TIMER_INTERVAL_DROP_IN = """\
+[Timer]
+OnUnitActiveSec={interval}min
+"""
+
 
 def write_template(config_dir: Path, main_py_path: Path):
     """Write service content into given path."""
@@ -41,6 +78,26 @@ def write_template(config_dir: Path, main_py_path: Path):
     print(f'Wrote service template to {SERVICE_PATH}')
 
 
+def write_timer_templates(config_dir: Path, main_py_path: Path, interval: int):
+    """Write the one-shot service, the timer and the instance's interval."""
+    SERVICE_DIR.mkdir(parents=True, exist_ok=True)
+    path_env = subprocess.check_output(['printenv', 'PATH'], text=True).strip()
+    ONCE_SERVICE_PATH.write_text(
+        ONCE_SERVICE_TEMPLATE.format(
+            path_env=path_env,
+            cwd=config_dir,
+            main_py=main_py_path,
+        )
+    )
+    TIMER_PATH.write_text(TIMER_TEMPLATE)
+    drop_in_dir = SERVICE_DIR / f'game-notifier-once@{config_dir.name}.timer.d'
+    drop_in_dir.mkdir(exist_ok=True)
+    (drop_in_dir / 'interval.conf').write_text(
+        TIMER_INTERVAL_DROP_IN.format(interval=interval)
+    )
+    print(f'Wrote timer templates to {SERVICE_DIR}')
+
+
 def run_systemctl(cmd: str, *args):
     """Run a systemctl command as user."""
     full = ['systemctl', '--user', cmd, *args]
@@ -61,3 +118,17 @@ def setup_game_notifier_instance(config_dir: Path, main_py: Path):
     run_systemctl('enable', '--now', f'game-notifier@{instance}')
 
     print('Service enabled and started.')
+
+
+def setup_game_notifier_timer(config_dir: Path, main_py: Path, interval: int):
+    """Handle the installation flow for single runs started by a timer.
+
+    Instead of a daemon sleeping between checks, a timer starts
+    `main.py --once` every `interval` minutes.
+    """
+    write_timer_templates(config_dir, main_py, interval)
+    run_systemctl('daemon-reload')
+    instance = config_dir.name
+    run_systemctl('enable', '--now', f'game-notifier-once@{instance}.timer')
+
+    print('Timer enabled and started.')
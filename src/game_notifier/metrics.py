@@ -0,0 +1,329 @@
+"""In-process metrics exposed in the Prometheus text format."""
+
+from __future__ import annotations
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Iterator, Optional, TypeVar
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = tuple[str, ...]
+TFunc = TypeVar("TFunc", bound=Callable)
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"'
+        for name, value in zip(names, values, strict=True)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        """Create a counter, every label combination starts at 0."""
+        super().__init__(name, documentation, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add `amount` to the value of `labels`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        """Return one line per label combination."""
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        """Create a gauge without any values."""
+        super().__init__(name, documentation, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the value of `labels`."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> list[str]:
+        """Return the current value of every label combination."""
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Counts of observed values per bucket, plus their sum."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        """Create a histogram with `buckets` as upper bounds."""
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # per label values: count per bucket (+Inf last), sum
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Count `value` into its bucket."""
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._values[key]
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe how long the block took, also if it raised."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> list[str]:
+        """Return bucket, sum and count lines per label combination."""
+        with self._lock:
+            values = {key: (list(c), t[0]) for key, (c, t) in self._values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts, strict=False):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            plain = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{plain} {total}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+_registry: list[_Metric] = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+POLL_DURATION = _register(
+    Histogram(
+        "game_notifier_poll_duration_seconds",
+        "Time to fetch and check one source.",
+        ("source",),
+        buckets=DEFAULT_BUCKETS + (120, 300, 600),
+    )
+)
+POLL_ERRORS = _register(
+    Counter("game_notifier_poll_errors_total", "Failed polls.", ("source",))
+)
+ITEMS_CHECKED = _register(
+    Counter(
+        "game_notifier_items_checked_total",
+        "Fetched items checked for notifications.",
+        ("source",),
+    )
+)
+ITEMS_NOTIFIED = _register(
+    Counter(
+        "game_notifier_items_notified_total",
+        "Items that were due for a notification.",
+        ("source",),
+    )
+)
+LAST_SUCCESS = _register(
+    Gauge(
+        "game_notifier_last_success_timestamp_seconds",
+        "Unix time of the last successful poll.",
+        ("source",),
+    )
+)
+HTTP_DURATION = _register(
+    Histogram(
+        "game_notifier_http_request_duration_seconds",
+        "Duration of outgoing HTTP requests including retries.",
+        ("host", "method"),
+    )
+)
+HTTP_REQUESTS = _register(
+    Counter(
+        "game_notifier_http_requests_total",
+        "Outgoing HTTP requests by response status.",
+        ("host", "method", "status"),
+    )
+)
+HTTP_ERRORS = _register(
+    Counter(
+        "game_notifier_http_errors_total",
+        "Outgoing HTTP requests that got no response.",
+        ("host", "method"),
+    )
+)
+HTTP_THROTTLED = _register(
+    Counter(
+        "game_notifier_http_throttled_seconds_total",
+        "Time spent waiting for the request budget of a host.",
+        ("host",),
+    )
+)
+HTTP_COALESCED = _register(
+    Counter(
+        "game_notifier_http_coalesced_total",
+        "GET requests answered by an identical request already in flight.",
+        ("host",),
+    )
+)
+HTTP_CIRCUIT_OPEN = _register(
+    Gauge(
+        "game_notifier_http_circuit_open",
+        "1 while requests to a host are rejected after repeated failures.",
+        ("host",),
+    )
+)
+HTTP_REJECTED = _register(
+    Counter(
+        "game_notifier_http_rejected_total",
+        "Requests not sent because the circuit was open or the deadline passed.",
+        ("host", "reason"),
+    )
+)
+STALE_FALLBACKS = _register(
+    Counter(
+        "game_notifier_stale_fallbacks_total",
+        "Polls that used the last good data because fetching failed.",
+        ("source",),
+    )
+)
+DB_DURATION = _register(
+    Histogram(
+        "game_notifier_db_operation_duration_seconds",
+        "Duration of database operations.",
+        ("operation",),
+    )
+)
+NOTIFICATIONS_SENT = _register(
+    Counter(
+        "game_notifier_notifications_total",
+        "Notifications sent to ntfy by result.",
+        ("result",),
+    )
+)
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable[[TFunc], TFunc]:
+    """Observe the duration of every call of the decorated function."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    """Return all metrics in the Prometheus text format."""
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.header())
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def serve(port: int, address: str = "127.0.0.1") -> None:
+    """Serve /metrics from a background thread."""
+    # only imported when metrics are enabled, it is slow to import
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header(
+                "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+            )
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    global _server
+    _server = ThreadingHTTPServer((address, port), Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"SETUP: serving metrics on http://{address}:{port}/metrics")
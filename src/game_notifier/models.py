@@ -3,6 +3,22 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+
+@dataclass(frozen=True, slots=True)
+class Region:
+    """Store region, decides prices, currency and language."""
+
+    country: str = "DE"
+    # used by Epic Games
+    locale: str = "de"
+    # used by Steam
+    language: str = "german"
+
+
+DEFAULT_REGION = Region()
 
 
 @dataclass(frozen=True, slots=True)
@@ -12,6 +28,46 @@ class EpicGame:
     store_url: str = ""
 
 
+@dataclass(frozen=True, slots=True)
+class EpicCandidate:
+    """The parts of a promotions document element that are used."""
+
+    title: str
+    discount_price: Optional[int] = None
+    # start and end of every current percentage discount
+    discount_windows: tuple[tuple[datetime, datetime], ...] = ()
+    # start and end of every current and upcoming promotion
+    boundaries: tuple[datetime, ...] = ()
+    banner_url: str = ""
+    page_slug: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class PriceAlert:
+    """What is special about a price compared to its history."""
+
+    all_time_low: bool = False
+    # how far the price is below the median of the last 90 days
+    below_median_percent: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class PriceAlertRules:
+    """Which price alerts are worth a notification."""
+
+    all_time_low: bool = False
+    # notify if the price is at least this far below the median, 0 disables
+    below_median_percent: int = 0
+
+    def matches(self, alert: PriceAlert) -> bool:
+        """Check whether `alert` satisfies any of the rules."""
+        if self.all_time_low and alert.all_time_low:
+            return True
+        return bool(self.below_median_percent) and (
+            alert.below_median_percent >= self.below_median_percent
+        )
+
+
 @dataclass(frozen=True, slots=True)
 class SteamSaleHit:
     appid: int
@@ -20,3 +76,50 @@ class SteamSaleHit:
     banner_url: str = ""
     store_url: str = ""
     price: str = ""
+    final_cents: int = 0
+    alert: PriceAlert = PriceAlert()
+
+
+@dataclass(frozen=True, slots=True)
+class SteamGameRule:
+    """When to notify about a single steam game, unset fields keep the defaults."""
+
+    appid: int
+    # notify once the price is at most this many cents, even without discount
+    max_price: Optional[int] = None
+    # notify about discounts of at least this many percent instead of any
+    min_discount: Optional[int] = None
+    # seconds until the game may be notified about again
+    cooldown: Optional[int] = None
+
+    def matches(self, discount_percentage: int, final_cents: int) -> bool:
+        """Check whether a sale at this discount and price is worth a notification."""
+        if self.max_price is not None and 0 < final_cents <= self.max_price:
+            return True
+        if self.min_discount is not None:
+            return discount_percentage >= self.min_discount
+        # with only a target price, discounts above it are not interesting
+        return self.max_price is None and discount_percentage > 0
+
+
+@dataclass(frozen=True, slots=True)
+class SteamAppMeta:
+    """Name and banner of a steam game, looked up once and cached."""
+
+    appid: int
+    name: str = ""
+    header_image: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class OutboxMessage:
+    """A notification waiting in the outbox to be sent."""
+
+    id: int
+    topic: str
+    message: str
+    image_url: str = ""
+    store_url: str = ""
+    attempts: int = 0
+    # the message is formatted as markdown, e.g. a digest with links
+    markdown: bool = False
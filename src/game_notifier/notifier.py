@@ -2,30 +2,220 @@
 Handles notifications sent to users
 """
 
-from datetime import datetime
+from contextlib import nullcontext
 from pathlib import Path
-import time
+from typing import TYPE_CHECKING, Iterable, Optional
+
 import requests
 
-from game_notifier.sources import EpicSource, SteamSource
-from game_notifier.sources.base import GameStoreSource
+from game_notifier import clock, database, http_client, metrics, utils
+from game_notifier.models import (
+    DEFAULT_REGION,
+    OutboxMessage,
+    PriceAlertRules,
+    Region,
+    SteamGameRule,
+)
+from game_notifier.sources.base import GameStoreSource, retention_seconds
+
+if TYPE_CHECKING:
+    from game_notifier.profiling import CycleProfiler
+
+# failed deliveries are retried after 30s, 1min, 2min, ... up to an hour
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+# client errors other than these fail the same way every time, e.g. a wrong
+# topic, missing access or a message that is too large
+RETRYABLE_CLIENT_ERRORS = (408, 425, 429)
+# bytes per digest, ntfy turns longer messages into attachments
+DIGEST_MAX_BYTES = 4096
+# due messages merged into digests at once
+DIGEST_BATCH = 300
 
 
-def send_ntfy(topic: str, message: str, image_url: str = "", store_url: str = ""):
+def send_ntfy(
+    topic: str,
+    message: str,
+    image_url: str = "",
+    store_url: str = "",
+    markdown: bool = False,
+):
     """uses ntfy with a valid topic to send out a notification
 
     :param str topic: url with protocol and path to a ntfy topic
     :param str message: content of the notification
     :param str image_url: url to a valid image (jpg, png, ...)
     :param str store_url: url to store page or place to claim
+    :param bool markdown: let clients render the message as markdown
+    :raises requests.RequestException: if the notification was not accepted
     """
     headers = {}
+    if markdown:
+        headers["Markdown"] = "yes"
     if image_url:
         headers["Attach"] = image_url
     if store_url:
         headers["Actions"] = f"view, store page, {store_url}"
 
-    requests.post(topic, data=message.encode(encoding="utf-8"), headers=headers)
+    try:
+        with http_client.post(
+            topic, data=message.encode(encoding="utf-8"), headers=headers
+        ) as response:
+            response.raise_for_status()
+    except requests.RequestException:
+        metrics.NOTIFICATIONS_SENT.inc(result="failed")
+        raise
+    metrics.NOTIFICATIONS_SENT.inc(result="sent")
+
+
+def retry_delay(attempts: int) -> int:
+    """Seconds to wait before the next try after `attempts` failed tries."""
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def is_permanent_error(error: requests.RequestException) -> bool:
+    """Whether sending the same request again would fail the same way."""
+    status = error.response.status_code if error.response is not None else 0
+    return 400 <= status < 500 and status not in RETRYABLE_CLIENT_ERRORS
+
+
+def deliver_message(db: database.Database, message: OutboxMessage) -> bool:
+    """Try to send a message from the outbox.
+
+    On success the message is removed and its entries count as notified.
+    Messages ntfy refuses for good are dropped, their entries are queued
+    again in a later cycle. Otherwise it is rescheduled with backoff.
+    """
+    try:
+        send_ntfy(
+            message.topic,
+            message.message,
+            image_url=message.image_url,
+            store_url=message.store_url,
+            markdown=message.markdown,
+        )
+    except requests.RequestException as e:
+        if is_permanent_error(e):
+            print(f"sending failed for good ({e!r}), dropping the message")
+            db.discard_outbox(message.id)
+            return False
+        attempts = message.attempts + 1
+        delay = retry_delay(attempts)
+        print(f"sending failed ({e!r}), attempt {attempts}, retrying in {delay}s")
+        db.retry_outbox(message.id, attempts, utils.timestamp_now() + delay)
+        return False
+    db.complete_outbox(message.id)
+    return True
+
+
+def _digest_title(count: int) -> str:
+    return f"**{count} new deals**"
+
+
+def _digest_line(message: OutboxMessage) -> str:
+    line = f"- {message.message}"
+    if message.store_url:
+        line += f" [store page]({message.store_url})"
+    return line
+
+
+def compose_digest(messages: list[OutboxMessage]) -> str:
+    """Summarize several messages as a markdown list with a link per game."""
+    lines = [_digest_title(len(messages)), ""]
+    lines += [_digest_line(message) for message in messages]
+    return "\n".join(lines)
+
+
+def split_digests(messages: list[OutboxMessage]) -> list[list[OutboxMessage]]:
+    """Group messages so that no digest is longer than `DIGEST_MAX_BYTES`.
+
+    A message too long for a digest on its own gets a group of its own.
+    """
+    groups: list[list[OutboxMessage]] = []
+    group: list[OutboxMessage] = []
+    # the blank line after the title and a line break per message
+    size = 1
+    for message in messages:
+        line = len(_digest_line(message).encode("utf-8")) + 1
+        title = len(_digest_title(len(group) + 1).encode("utf-8"))
+        if group and title + size + line > DIGEST_MAX_BYTES:
+            groups.append(group)
+            group, size = [], 1
+        group.append(message)
+        size += line
+    if group:
+        groups.append(group)
+    return groups
+
+
+def digest_outbox(db: database.Database) -> int:
+    """Merge the due messages of each topic into digests, returns how many.
+
+    Messages that already failed to send are left alone, so a digest is
+    never merged into another one.
+    """
+    by_topic: dict[str, list[OutboxMessage]] = {}
+    for message in db.due_outbox(limit=DIGEST_BATCH):
+        if message.attempts == 0 and not message.markdown:
+            by_topic.setdefault(message.topic, []).append(message)
+
+    digests = 0
+    for topic, messages in by_topic.items():
+        for group in split_digests(messages):
+            if len(group) > 1:
+                db.merge_outbox([m.id for m in group], topic, compose_digest(group))
+                digests += 1
+    return digests
+
+
+def deliver_outbox(db: database.Database, rate_limit: float, digest: bool = False):
+    """Send every due outbox message one after another.
+
+    :param float rate_limit: maximum messages per minute
+    :param bool digest: send the messages of each topic as a single digest
+    """
+    if digest:
+        digest_outbox(db)
+    for i, message in enumerate(db.due_outbox()):
+        if i:
+            clock.sleep(60 / rate_limit)
+        print("sending notification:", message.message)
+        deliver_message(db, message)
+
+
+def build_sources(
+    notify_epic: bool,
+    steam_game_ids: list[int],
+    working_dir: Optional[Path] = None,
+    steam_alert_rules: Optional[PriceAlertRules] = None,
+    region: Region = DEFAULT_REGION,
+    rolling_steam: bool = False,
+    steam_game_rules: Optional[Iterable[SteamGameRule]] = None,
+) -> list[GameStoreSource]:
+    """Create the sources enabled by the configuration.
+
+    Only the enabled stores are imported. The steam game rules are read
+    from the database in `working_dir` unless given.
+    """
+    sources: list[GameStoreSource] = []
+    if notify_epic:
+        from game_notifier.sources.epic import EpicSource
+
+        sources.append(EpicSource(region))
+    if steam_game_ids:
+        from game_notifier.sources.steam import SteamSource
+
+        sources.append(
+            SteamSource(
+                steam_game_ids,
+                working_dir,
+                steam_alert_rules,
+                region,
+                rolling_steam,
+                steam_game_rules,
+            )
+        )
+    return sources
 
 
 def loop(
@@ -34,27 +224,48 @@ def loop(
     notify_epic: bool,
     steam_game_ids: list[int],
     working_dir: Path,
+    rate_limit: float = 12,
+    steam_alert_rules: Optional[PriceAlertRules] = None,
+    region: Region = DEFAULT_REGION,
+    digest: bool = False,
+    profiler: Optional["CycleProfiler"] = None,
+    until: Optional[float] = None,
 ):
-    """Execute program logic after everything is set up."""
-    while True:
-        sources: list[GameStoreSource] = []
-        if notify_epic:
-            sources.append(EpicSource())
-        if steam_game_ids:
-            sources.append(SteamSource(steam_game_ids))
-
-        for source in sources:
-            for notification in source.poll(working_dir):
-                print(f"sending notification for {source.name}:", notification.message)
-                send_ntfy(
-                    topic,
-                    notification.message,
-                    image_url=notification.image_url,
-                    store_url=notification.store_url,
-                )
+    """Execute program logic after everything is set up.
+
+    :param CycleProfiler profiler: profiles the cycles, not the waits between
+    :param float until: unix timestamp on the clock to stop at, never if None
+    """
+    db = database.open_database(working_dir)
+    # the settings are fixed for the whole loop, the sources keep their
+    # last good data between cycles for the stale-data fallback
+    sources = build_sources(
+        notify_epic, steam_game_ids, working_dir, steam_alert_rules, region
+    )
+    while until is None or clock.time() < until:
+        with profiler.cycle() if profiler else nullcontext():
+            for source in sources:
+                try:
+                    with http_client.deadline():
+                        notifications = list(source.poll(working_dir))
+                except Exception as e:
+                    # the other sources and the outbox should not suffer
+                    print(f"polling {source.name} failed:", repr(e))
+                    continue
+                for notification in notifications:
+                    print(
+                        f"queueing notification for {source.name}:",
+                        notification.message,
+                    )
+                db.enqueue(topic, notifications)
+            # everything found in this cycle is in the outbox by now
+            deliver_outbox(db, rate_limit, digest)
+            if database.maintain(working_dir, retention_seconds(sources)):
+                pruned = http_client.prune_cache()
+                print(f"pruned {pruned} old cached responses")
 
         print(
             f"done, next iteration in {poll_interval}min, time now is:",
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            clock.now().astimezone().strftime("%Y-%m-%d %H:%M:%S"),
         )
-        time.sleep(poll_interval * 60)
+        clock.sleep(poll_interval * 60)
@@ -0,0 +1,130 @@
+"""Profile poll cycles of the running notifier.
+
+Each profiled cycle writes a report to the config directory with the
+functions that took the most time, the lines that hold the most memory and
+how much memory grew since the previous cycle. The raw cProfile data is
+written next to it for tools like snakeviz.
+
+Only the first `cycles` cycles are profiled, afterwards tracing stops and
+the notifier runs at full speed again.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+# frames kept per allocation, more would make tracing slower
+TRACE_FRAMES = 1
+# lines per section of a report
+REPORT_TOP = 25
+# allocations of the profiling itself are of no interest
+IGNORED_FILES = (
+    tracemalloc.__file__,
+    cProfile.__file__,
+    pstats.__file__,
+    "<frozen importlib._bootstrap>",
+    "<frozen importlib._bootstrap_external>",
+    "<unknown>",
+)
+
+
+def _kib(size: int) -> str:
+    return f"{size / 1024:.1f} KiB"
+
+
+class CycleProfiler:
+    """Profile CPU time and allocations of the cycles run inside `cycle()`."""
+
+    def __init__(self, config_dir: Path, cycles: int = 0, top: int = REPORT_TOP):
+        """Create the profiler, nothing is traced before the first cycle.
+
+        :param Path config_dir: reports go to `profile/<start time>/` in it
+        :param int cycles: how many cycles to profile, 0 for all of them
+        """
+        started = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.output_dir = config_dir / "profile" / started
+        self.cycles = cycles
+        self.top = top
+        self.profiled = 0
+        self._previous: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def active(self) -> bool:
+        """Check whether the next cycle is still profiled."""
+        return self.cycles == 0 or self.profiled < self.cycles
+
+    @contextmanager
+    def cycle(self) -> Iterator[None]:
+        """Profile everything run inside, unless enough cycles were profiled."""
+        if not self.active:
+            yield
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - started
+            self.profiled += 1
+            self._report(profile, duration)
+            if not self.active:
+                self._previous = None
+                tracemalloc.stop()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, name) for name in IGNORED_FILES]
+        )
+
+    def _report(self, profile: cProfile.Profile, duration: float) -> None:
+        snapshot = self._snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        stats_text = io.StringIO()
+        stats = pstats.Stats(profile, stream=stats_text)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+
+        lines = [
+            f"cycle {self.profiled}, {datetime.now():%Y-%m-%d %H:%M:%S}, "
+            f"{duration:.3f}s",
+            f"memory traced: current {_kib(current)}, peak {_kib(peak)}",
+            "",
+            "top allocation sites:",
+        ]
+        for stat in snapshot.statistics("lineno")[: self.top]:
+            lines.append(f"  {stat.traceback[0]}: {_kib(stat.size)} in {stat.count}")
+        if self._previous is not None:
+            lines += ["", "memory growth since the previous cycle:"]
+            growth = snapshot.compare_to(self._previous, "lineno")
+            for diff in growth[: self.top]:
+                if diff.size_diff == 0:
+                    break
+                lines.append(
+                    f"  {diff.traceback[0]}: {diff.size_diff / 1024:+.1f} KiB "
+                    f"({diff.count_diff:+d})"
+                )
+        lines += ["", "top functions by cumulative time:", stats_text.getvalue()]
+        self._previous = snapshot
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        name = f"cycle-{self.profiled:04d}"
+        report = self.output_dir / f"{name}.txt"
+        report.write_text("\n".join(lines))
+        profile.dump_stats(self.output_dir / f"{name}.prof")
+        print(
+            f"profiled cycle {self.profiled} in {duration:.3f}s, "
+            f"{_kib(current)} traced, report in {report}"
+        )
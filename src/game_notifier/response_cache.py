@@ -0,0 +1,130 @@
+"""On-disk cache of HTTP responses for conditional requests."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+# responses kept in memory, the least recently used ones are dropped first
+MAX_ENTRIES = 256
+
+
+@dataclass(slots=True)
+class CachedResponse:
+    """A response body with the validators to ask whether it changed."""
+
+    url: str
+    body: bytes
+    etag: str = ""
+    last_modified: str = ""
+    fetched_at: float = 0.0
+    # decoded body, only kept in memory
+    parsed: Any = None
+
+
+class ResponseCache:
+    """Responses keyed by URL, stored in `directory` if one is given.
+
+    At most `max_entries` are kept in memory, `prune` removes old files.
+    """
+
+    def __init__(
+        self, directory: Optional[Path] = None, max_entries: int = MAX_ENTRIES
+    ):
+        """Load entries from `directory` on demand, or keep them in memory only."""
+        self._directory = directory
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        assert self._directory is not None
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return (
+            self._directory / f"{name}.json",
+            self._directory / f"{name}.body",
+        )
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """Return the cached response of `url`, None if there is none."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+        if entry is not None or self._directory is None:
+            return entry
+
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            body = body_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        entry = CachedResponse(
+            url=url,
+            body=body,
+            etag=meta.get("etag", ""),
+            last_modified=meta.get("last_modified", ""),
+            fetched_at=meta.get("fetched_at", 0.0),
+        )
+        self._remember(entry)
+        return entry
+
+    def _remember(self, entry: CachedResponse) -> None:
+        with self._lock:
+            self._entries[entry.url] = entry
+            self._entries.move_to_end(entry.url)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, entry: CachedResponse, body_changed: bool = True) -> None:
+        """Store `entry`, the body is only written again if it changed."""
+        self._remember(entry)
+        if self._directory is None:
+            return
+
+        meta_path, body_path = self._paths(entry.url)
+        if body_changed:
+            _write_atomic(body_path, entry.body)
+        meta = {
+            "url": entry.url,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "fetched_at": entry.fetched_at,
+        }
+        _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def prune(self, oldest: float) -> int:
+        """Remove responses fetched before `oldest`, returns how many."""
+        with self._lock:
+            for url in [u for u, e in self._entries.items() if e.fetched_at < oldest]:
+                del self._entries[url]
+        if self._directory is None:
+            return 0
+
+        pruned = 0
+        for meta_path in self._directory.glob("*.json"):
+            try:
+                fetched_at = json.loads(meta_path.read_text()).get("fetched_at", 0.0)
+            except (OSError, ValueError):
+                fetched_at = 0.0
+            if fetched_at >= oldest:
+                continue
+            for path in (meta_path, meta_path.with_suffix(".body")):
+                path.unlink(missing_ok=True)
+            pruned += 1
+        return pruned
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
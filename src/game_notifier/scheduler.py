@@ -0,0 +1,54 @@
+"""Keeps track of when each source has to be polled next."""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+from typing import Optional
+
+
+class Scheduler:
+    """Priority queue of next-due times (unix timestamps) per source name.
+
+    Every name is in the queue at most once, scheduling it again replaces
+    the previous time.
+    """
+
+    def __init__(self):
+        """Create an empty schedule."""
+        self._queue: list[tuple[float, int, str]] = []
+        # name -> (id of the valid queue entry, its time)
+        self._current: dict[str, tuple[int, float]] = {}
+        self._counter = itertools.count()
+
+    def schedule(self, name: str, at: float) -> None:
+        """Let `name` be due at `at`, replacing its previous time."""
+        entry_id = next(self._counter)
+        self._current[name] = (entry_id, at)
+        heapq.heappush(self._queue, (at, entry_id, name))
+
+    def due_at(self, name: str) -> Optional[float]:
+        """Return when `name` is scheduled, None if it is not."""
+        current = self._current.get(name)
+        return current[1] if current else None
+
+    def _drop_replaced(self) -> None:
+        while self._queue:
+            _, entry_id, name = self._queue[0]
+            if self._current.get(name, (None,))[0] == entry_id:
+                return
+            heapq.heappop(self._queue)
+
+    def next_due(self) -> Optional[float]:
+        """Return the earliest scheduled time, None if nothing is scheduled."""
+        self._drop_replaced()
+        return self._queue[0][0] if self._queue else None
+
+    def pop_due(self, now: float) -> list[str]:
+        """Remove and return every name that is due at `now`."""
+        due: list[str] = []
+        while (at := self.next_due()) is not None and at <= now:
+            _, _, name = heapq.heappop(self._queue)
+            del self._current[name]
+            due.append(name)
+        return due
@@ -1,5 +1,18 @@
 """Store/source abstractions for fetching games and tracking notifications."""
 
 from .base import GameStoreSource, Notification
-from .epic import EpicSource
-from .steam import SteamSource
+
+__all__ = ["EpicSource", "GameStoreSource", "Notification", "SteamSource"]
+
+
+def __getattr__(name: str):
+    # stores are imported on first use, disabled ones cost no startup time
+    if name == "EpicSource":
+        from .epic import EpicSource
+
+        return EpicSource
+    if name == "SteamSource":
+        from .steam import SteamSource
+
+        return SteamSource
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
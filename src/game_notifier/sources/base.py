@@ -2,12 +2,18 @@
 
 from __future__ import annotations
 
+import asyncio
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Generic, Iterable, TypeVar
+from typing import TYPE_CHECKING, Generic, Iterable, Optional, TypeVar
 
-from game_notifier import database, utils
+from game_notifier import clock, database, metrics
+from game_notifier.models import Region
+
+if TYPE_CHECKING:
+    from game_notifier.engine import HostLimiter
 
 
 @dataclass(frozen=True, slots=True)
@@ -15,15 +21,36 @@ class Notification:
     message: str
     image_url: str = ""
     store_url: str = ""
+    # the entry this notification is about, marked notified once it is sent
+    source: str = ""
+    key: str = ""
 
 
 TItem = TypeVar("TItem")
 
 
+def retention_seconds(sources: Iterable[GameStoreSource]) -> dict[str, int]:
+    """Map source names to the seconds their notified entries are kept."""
+    return {
+        source.name: int(source.retention.total_seconds())
+        for source in sources
+        if source.retention is not None
+    }
+
+
 class GameStoreSource(ABC, Generic[TItem]):
     """Common interface for a store that can produce notifications."""
 
     name: str
+    # upstream host used to limit concurrent requests per host
+    host: str = ""
+    # time until an item may be notified about again, None for never
+    cooldown: Optional[timedelta] = None
+    # time notified entries are kept in the database, None for forever.
+    # Never shorter than the cooldown or items would be notified again early.
+    retention: Optional[timedelta] = None
+    # store region the items are fetched for
+    region: Region = Region()
 
     @abstractmethod
     def fetch(self) -> Iterable[TItem]:
@@ -37,18 +64,54 @@ class GameStoreSource(ABC, Generic[TItem]):
     def to_notification(self, item: TItem) -> Notification:
         raise NotImplementedError
 
-    @abstractmethod
-    def should_notify(self, working_dir: Path, key: str) -> bool:
-        raise NotImplementedError
+    def wants(self, item: TItem) -> bool:
+        """Whether this source is interested in an item fetched by another one."""
+        return True
+
+    def due_keys(self, working_dir: Path, keys: Iterable[str]) -> set[str]:
+        """Return the keys that should be notified about."""
+        cooldown = None
+        if self.cooldown is not None:
+            cooldown = int(self.cooldown.total_seconds())
+        return database.open_database(working_dir).due_keys(self.name, keys, cooldown)
+
+    async def fetch_async(self, limiter: HostLimiter) -> list[TItem]:
+        """Fetch items without blocking the event loop.
+
+        Sources that can split their work into several requests should
+        override this to run them concurrently.
+        """
+        async with limiter(self.host):
+            return await asyncio.to_thread(lambda: list(self.fetch()))
 
-    def save_notified(self, working_dir: Path, key: str) -> None:
-        database.sqlite_set_notification(
-            working_dir, source=self.name, key=key, last_notified=utils.todays_date()
-        )
+    def next_poll(self, now: datetime, interval: timedelta) -> datetime:
+        """Return when this source should be polled again."""
+        return now + interval
 
     def poll(self, working_dir: Path) -> Iterable[Notification]:
-        for item in self.fetch():
-            key = self.item_key(item)
-            if self.should_notify(working_dir, key):
-                self.save_notified(working_dir, key)
-                yield self.to_notification(item)
+        with metrics.POLL_DURATION.time(source=self.name):
+            try:
+                notifications = self.select(working_dir, self.fetch())
+            except Exception:
+                metrics.POLL_ERRORS.inc(source=self.name)
+                raise
+        metrics.LAST_SUCCESS.set(clock.time(), source=self.name)
+        return notifications
+
+    def select(
+        self, working_dir: Path, items: Iterable[TItem]
+    ) -> list[Notification]:
+        """Return notifications for the fetched items that are due.
+
+        Nothing is marked as notified here, that happens once the
+        notification was delivered from the outbox.
+        """
+        by_key = {self.item_key(item): item for item in items}
+        due = self.due_keys(working_dir, by_key)
+        metrics.ITEMS_CHECKED.inc(len(by_key), source=self.name)
+        metrics.ITEMS_NOTIFIED.inc(len(due), source=self.name)
+        return [
+            replace(self.to_notification(item), source=self.name, key=key)
+            for key, item in by_key.items()
+            if key in due
+        ]
@@ -2,30 +2,63 @@
 
 from __future__ import annotations
 
-from pathlib import Path
-from typing import Iterable
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
 
-from game_notifier import database, fetcher
-from game_notifier.models import EpicGame
+import requests
+
+from game_notifier import clock, fetcher, metrics
+from game_notifier.models import EpicCandidate, EpicGame, Region
 
 from .base import GameStoreSource, Notification
 
 
 class EpicSource(GameStoreSource[EpicGame]):
     name = "epic"
+    host = fetcher.EPIC_HOST
+    # titles are notified only once, but a promotion from a year ago is over
+    retention = timedelta(days=365)
+
+    def __init__(self, region: Region = fetcher.DEFAULT_REGION):
+        """Create the source for the store of `region`."""
+        self.region = region
+        self._boundaries: list[datetime] = []
+        self._at_boundary = False
+        # last good promotions document and when it was fetched
+        self._last_games: Optional[list[EpicCandidate]] = None
+        self._last_fetched = 0.0
 
     def fetch(self) -> Iterable[EpicGame]:
-        return fetcher.epic_free_games()
+        # right after a promotion started or ended a cached document is stale
+        ttl = 0 if self._at_boundary else fetcher.EPIC_CACHE_TTL
+        try:
+            games = fetcher.epic_games(ttl=ttl, region=self.region)
+        except (requests.RequestException, ValueError) as e:
+            age = clock.time() - self._last_fetched
+            if self._last_games is None or age > fetcher.EPIC_STALE_MAX_AGE:
+                raise
+            print(f"Epic is unavailable ({e}), using promotions from {age:.0f}s ago")
+            metrics.STALE_FALLBACKS.inc(source=self.name)
+            games = self._last_games
+        else:
+            self._last_games = games
+            self._last_fetched = clock.time()
+        self._boundaries = fetcher.epic_promotion_boundaries(games)
+        # one point in time for every promotion of this cycle
+        now = clock.now()
+        return fetcher.epic_free_games(games, self.region, now)
+
+    def next_poll(self, now: datetime, interval: timedelta) -> datetime:
+        """Poll at the next promotion start or end if it is before `interval`."""
+        grace = timedelta(seconds=fetcher.EPIC_BOUNDARY_GRACE)
+        upcoming = [b + grace for b in self._boundaries if b + grace > now]
+        regular = now + interval
+        self._at_boundary = bool(upcoming) and upcoming[0] < regular
+        return upcoming[0] if self._at_boundary else regular
 
     def item_key(self, item: EpicGame) -> str:
         return item.title
 
-    def should_notify(self, working_dir: Path, key: str) -> bool:
-        return (
-            database.sqlite_get_notification(working_dir, source=self.name, key=key)
-            is None
-        )
-
     def to_notification(self, item: EpicGame) -> Notification:
         return Notification(
             message=f"{item.title} is currently free on Epic Games!",
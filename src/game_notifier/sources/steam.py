@@ -2,42 +2,303 @@
 
 from __future__ import annotations
 
+import asyncio
+import math
+from dataclasses import replace
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Iterable
+from typing import TYPE_CHECKING, Iterable, Optional
 
-from game_notifier import database, fetcher, utils
-from game_notifier.models import SteamSaleHit
+from game_notifier import database, fetcher, metrics, utils
+from game_notifier.models import (
+    PriceAlert,
+    PriceAlertRules,
+    Region,
+    SteamAppMeta,
+    SteamGameRule,
+    SteamSaleHit,
+)
 
 from .base import GameStoreSource, Notification
 
+if TYPE_CHECKING:
+    from game_notifier.engine import HostLimiter
+
 
 class SteamSource(GameStoreSource[SteamSaleHit]):
     name = "steam"
+    host = fetcher.STEAM_HOST
+    cooldown = timedelta(days=7)
+    # an entry past its cooldown behaves exactly like a missing one
+    retention = cooldown
+
+    def __init__(
+        self,
+        wanted_game_ids: list[int],
+        working_dir: Optional[Path] = None,
+        alert_rules: Optional[PriceAlertRules] = None,
+        region: Region = fetcher.DEFAULT_REGION,
+        rolling: bool = False,
+        rules: Optional[Iterable[SteamGameRule]] = None,
+    ):
+        """Create the source.
 
-    def __init__(self, wanted_game_ids: list[int]):
+        :param Path working_dir: enables the metadata cache and price history
+            in its database
+        :param PriceAlertRules alert_rules: when to notify about games that
+            are not discounted
+        :param Region region: store region, its prices must not share a
+            database with another region's
+        :param bool rolling: let `fetch_async` check one batch per poll
+            instead of all of them, see `next_poll`
+        :param rules: per game rules, read from the database in `working_dir`
+            unless given
+        """
         self._wanted_game_ids = wanted_game_ids
+        self._wanted_set = set(wanted_game_ids)
+        self._working_dir = working_dir
+        self._alert_rules = alert_rules or PriceAlertRules()
+        self.region = region
+        self.rolling = rolling
+        # position of the next rolling batch in the games that are not hot
+        self._offset = 0
+        self._hot: list[int] = []
+        self._batches_per_interval = 1
+        # last good price_overview of every game and when it was fetched
+        self._last_prices: dict[int, tuple[int, dict]] = {}
+        if rules is None and working_dir is not None:
+            rules = database.open_database(working_dir).steam_game_rules().values()
+        self.set_rules(rules or ())
 
-    def fetch(self) -> Iterable[SteamSaleHit]:
-        hits: list[SteamSaleHit] = []
-        for appid in self._wanted_game_ids:
-            sale_hit = fetcher.steam_sale(appid)
-            if sale_hit:
-                hits.append(sale_hit)
-        return hits
+    @property
+    def wanted_game_ids(self) -> list[int]:
+        """Appids of the games checked by this source."""
+        return self._wanted_game_ids
 
-    def item_key(self, item: SteamSaleHit) -> str:
-        return str(item.appid)
+    @property
+    def rules(self) -> tuple[SteamGameRule, ...]:
+        """Return the rules of the watched games."""
+        return tuple(self._rules.values())
+
+    def set_rules(self, rules: Iterable[SteamGameRule]) -> None:
+        """Index the per game rules by appid, so a hit is checked in O(1)."""
+        self._rules = {rule.appid: rule for rule in rules}
+        self._price_targets = {
+            rule.appid: rule.max_price
+            for rule in self._rules.values()
+            if rule.max_price is not None
+        }
+        # notified games are kept as long as the longest cooldown needs them
+        self.retention = max(
+            [self.cooldown]
+            + [timedelta(seconds=r.cooldown) for r in self.rules if r.cooldown]
+        )
 
-    def should_notify(self, working_dir: Path, key: str) -> bool:
-        last_notified = database.sqlite_get_notification(
-            working_dir, source=self.name, key=key
+    def subset(self, appids: list[int]) -> SteamSource:
+        """Return a source for some games that shares database and region."""
+        return SteamSource(
+            appids,
+            self._working_dir,
+            self._alert_rules,
+            self.region,
+            rules=self.rules,
         )
-        if last_notified is None:
+
+    def set_wanted_game_ids(self, wanted_game_ids: list[int]) -> list[int]:
+        """Change the games to check, returns the ones that were not checked."""
+        added = [i for i in wanted_game_ids if i not in self._wanted_set]
+        self._wanted_game_ids = wanted_game_ids
+        self._wanted_set = set(wanted_game_ids)
+        return added
+
+    def wants(self, item: SteamSaleHit) -> bool:
+        """Check whether a hit is worth a notification for the wanted games."""
+        if item.appid not in self._wanted_set:
+            return False
+        if self._alert_rules.matches(item.alert):
             return True
-        return not utils.is_date_within_days(last_notified, 7)
+        rule = self._rules.get(item.appid)
+        if rule is None:
+            return item.discount_percentage > 0
+        return rule.matches(item.discount_percentage, item.final_cents)
+
+    def due_keys(self, working_dir: Path, keys: Iterable[str]) -> set[str]:
+        """Return the keys that are due, using the cooldown of each game's rule."""
+        by_cooldown: dict[Optional[int], list[str]] = {}
+        for key in keys:
+            rule = self._rules.get(int(key.partition(":")[0]))
+            cooldown = rule.cooldown if rule is not None else None
+            by_cooldown.setdefault(cooldown, []).append(key)
+        db = database.open_database(working_dir)
+        due: set[str] = set()
+        # one query per distinct cooldown, not per game
+        for cooldown, group in by_cooldown.items():
+            if cooldown is None:
+                cooldown = int(self.cooldown.total_seconds())
+            due |= db.due_keys(self.name, group, cooldown)
+        return due
+
+    def select(
+        self, working_dir: Path, items: Iterable[SteamSaleHit]
+    ) -> list[Notification]:
+        """Return notifications for the fetched hits that are due.
+
+        A price alert is only raised on the check where the price changed,
+        held back by the cooldown of its game it would never be sent. So if
+        the game is not due, the alert is keyed by game and price instead,
+        which leaves the cooldown of the game as it is.
+        """
+        by_game = {self.item_key(hit): hit for hit in items}
+        due = self.due_keys(working_dir, by_game)
+        by_key = {}
+        alert_keys = []
+        for key, hit in by_game.items():
+            if key not in due and self._alert_rules.matches(hit.alert):
+                key = f"{key}:{hit.final_cents}"
+                alert_keys.append(key)
+            by_key[key] = hit
+        if alert_keys:
+            due |= self.due_keys(working_dir, alert_keys)
+        metrics.ITEMS_CHECKED.inc(len(by_key), source=self.name)
+        metrics.ITEMS_NOTIFIED.inc(len(due), source=self.name)
+        return [
+            replace(self.to_notification(hit), source=self.name, key=key)
+            for key, hit in by_key.items()
+            if key in due
+        ]
+
+    def _observe(self, prices: dict[int, dict]) -> dict[int, PriceAlert]:
+        """Record the price history and check it for alerts.
+
+        Games that reached a rule's target price get an empty alert, so they
+        are returned without a discount as well.
+        """
+        now = utils.timestamp_now()
+        self._last_prices.update((appid, (now, info)) for appid, info in prices.items())
+        alerts: dict[int, PriceAlert] = {}
+        if self._working_dir is not None:
+            db = database.open_database(self._working_dir)
+            alerts = db.record_steam_prices(
+                {
+                    appid: info["final"]
+                    for appid, info in prices.items()
+                    if "final" in info
+                }
+            )
+        for appid, info in prices.items():
+            target = self._price_targets.get(appid)
+            if target is not None and 0 < info.get("final", 0) <= target:
+                alerts.setdefault(appid, PriceAlert())
+        return alerts
+
+    def _stale_prices(self, appids: list[int]) -> dict[int, dict]:
+        """Return the last good prices that are recent enough to be trusted."""
+        oldest = utils.timestamp_now() - fetcher.STEAM_STALE_MAX_AGE
+        prices = {}
+        for appid in appids:
+            fetched_at, info = self._last_prices.get(appid, (0, {}))
+            if fetched_at >= oldest:
+                prices[appid] = info
+        if prices:
+            metrics.STALE_FALLBACKS.inc(source=self.name)
+        return prices
+
+    def _lookup_meta(self, appids: list[int]) -> dict[int, SteamAppMeta]:
+        """Take name and banner from the database, only fetch unknown games."""
+        if self._working_dir is None:
+            return fetcher.steam_app_metas(appids, self.region)
+
+        db = database.open_database(self._working_dir)
+        metas = db.get_steam_apps(appids, max_age=fetcher.STEAM_METADATA_TTL)
+        missing = [appid for appid in appids if appid not in metas]
+        if missing:
+            fetched = fetcher.steam_app_metas(missing, self.region)
+            db.set_steam_apps(fetched.values())
+            metas.update(fetched)
+        return metas
+
+    def _fetch_batch(self, appids: list[int], cache: bool = True) -> list[SteamSaleHit]:
+        return fetcher.steam_sales(
+            appids,
+            lookup_meta=self._lookup_meta,
+            observe=self._observe,
+            region=self.region,
+            stale=self._stale_prices,
+            cache=cache,
+        )
+
+    def fetch(self) -> Iterable[SteamSaleHit]:
+        hits = self._fetch_batch(self._wanted_game_ids)
+        return [hit for hit in hits if self.wants(hit)]
+
+    def _recently_changed(self) -> list[int]:
+        if self._working_dir is None:
+            return []
+        db = database.open_database(self._working_dir)
+        since = utils.timestamp_now() - fetcher.STEAM_HOT_WINDOW
+        return db.recent_price_changes(self._wanted_game_ids, since)
+
+    def _next_batch(self) -> list[int]:
+        """Return the games of the next rolling request.
+
+        Games whose price changed lately are part of every request, the
+        others take turns. Which games are hot is decided once per round.
+        """
+        if self._offset == 0:
+            self._hot = self._recently_changed()[: fetcher.STEAM_HOT_SLOTS]
+        hot = set(self._hot)
+        cold = [i for i in self._wanted_game_ids if i not in hot]
+        per_batch = fetcher.STEAM_BATCH_SIZE - len(hot)
+        if self._offset >= len(cold):
+            self._offset = 0
+        batch = cold[self._offset : self._offset + per_batch]
+        self._offset += per_batch
+        if self._offset >= len(cold):
+            self._offset = 0
+        self._batches_per_interval = max(1, math.ceil(len(cold) / per_batch))
+        return [i for i in self._hot if i in self._wanted_set] + batch
+
+    async def fetch_async(self, limiter: HostLimiter) -> list[SteamSaleHit]:
+        """Fetch the batches concurrently, or the next one when rolling."""
+        async def fetch_batch(batch: list[int]) -> list[SteamSaleHit]:
+            async with limiter(self.host):
+                return await asyncio.to_thread(self._fetch_batch, batch, cache)
+
+        size = fetcher.STEAM_BATCH_SIZE
+        ids = self._wanted_game_ids
+        # rolling batches change with the hot games, every composition
+        # would stay in the response cache for good
+        cache = not (self.rolling and len(ids) > size)
+        if not cache:
+            batches = [await asyncio.to_thread(self._next_batch)]
+        else:
+            self._batches_per_interval = 1
+            batches = [ids[i : i + size] for i in range(0, len(ids), size)]
+        results = await asyncio.gather(*(fetch_batch(batch) for batch in batches))
+        # unfiltered, tenants sharing this fetch pick their hits with `wants`
+        return [hit for hits in results for hit in hits]
+
+    def next_poll(self, now: datetime, interval: timedelta) -> datetime:
+        """Spread rolling requests evenly over the interval."""
+        return now + interval / self._batches_per_interval
+
+    def item_key(self, item: SteamSaleHit) -> str:
+        return str(item.appid)
 
     def to_notification(self, item: SteamSaleHit) -> Notification:
-        message = (
-            f"{item.title} is on sale for {item.price}! (-{item.discount_percentage}%)"
+        if item.discount_percentage > 0:
+            message = (
+                f"{item.title} is on sale for {item.price}! "
+                f"(-{item.discount_percentage}%)"
+            )
+        else:
+            message = f"{item.title} is down to {item.price}!"
+        if item.alert.all_time_low:
+            message += " All-time low!"
+        elif item.alert.below_median_percent:
+            message += f" {item.alert.below_median_percent}% below its 90-day median."
+        return Notification(
+            message=message,
+            image_url=item.banner_url,
+            store_url=item.store_url or fetcher.steam_store_url(item.appid),
         )
-        return Notification(message=message, image_url=item.banner_url)
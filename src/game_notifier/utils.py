@@ -1,19 +1,29 @@
 """Utility functions."""
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
 
+from game_notifier import clock
+
 
 def todays_date() -> str:
     """Get todays date in the Format of YYYY-MM-DD."""
-    return datetime.now().date().strftime(r"%Y-%m-%d")
+    return datetime.fromtimestamp(clock.time()).date().strftime(r"%Y-%m-%d")
+
+
+def timestamp_now() -> int:
+    """Get the current time as unix timestamp in seconds."""
+    return int(clock.time())
+
+
+def date_to_timestamp(date: str) -> int:
+    """Convert a local date in the Format of YYYY-MM-DD to a unix timestamp."""
+    return int(datetime.strptime(date, r"%Y-%m-%d").timestamp())
 
 
-def is_date_within_days(date: str, delta: int) -> bool:
-    """Check whether the given date is within `delta` days before today."""
-    today = datetime.strptime(todays_date(), r"%Y-%m-%d")
-    past_date = datetime.strptime(date, r"%Y-%m-%d")
-    return past_date + timedelta(days=delta) >= today
+def timestamp_to_date(timestamp: int) -> str:
+    """Convert a unix timestamp to a local date in the Format of YYYY-MM-DD."""
+    return datetime.fromtimestamp(timestamp).date().strftime(r"%Y-%m-%d")
 
 
 def remove_env_from_path(path: Path) -> Path:
@@ -4,27 +4,39 @@ monitors for changes according to preferences set in .env file and notifies via
 """
 
 import argparse
-import os
 import sys
-from game_notifier import notifier, database, install
+from game_notifier import config, database
 from pathlib import Path
-import dotenv
 
+# everything else is imported where it is needed, which keeps `--once` fast
 
-def init(config_dir: Path, script_dir: Path, skip_service: bool):
+
+def init(config_dir: Path, script_dir: Path, skip_service: bool, once: bool):
     """Initialize everything in order to set everything up.
 
     :param Path working_dir: working directory where to store file (without filename)
+    :param bool once: install a timer running single cycles instead of a daemon
     """
     print("trying to init database..")
     database.init_sqlite_db(config_dir)
 
     if not skip_service:
+        from game_notifier import install
+
         print(
             f"Installing service with config directory: {config_dir} "
             f"and script directory: {script_dir}"
         )
-        install.setup_game_notifier_instance(config_dir, script_dir)
+        if once:
+            try:
+                settings = config.load_settings(config_dir)
+            except ValueError as e:
+                print(f"Error in {config_dir}: {e}")
+                sys.exit(1)
+            interval = min(settings.epic_poll_interval, settings.steam_poll_interval)
+            install.setup_game_notifier_timer(config_dir, script_dir, interval)
+        else:
+            install.setup_game_notifier_instance(config_dir, script_dir)
 
 
 def parse_args():
@@ -36,13 +48,30 @@ def parse_args():
         "-i", "--install", action="store_true", help="Install service"
     )
     main_group.add_argument("-r", "--run", action="store_true", help="Run the notifier")
+    main_group.add_argument(
+        "--import-steam-catalog",
+        nargs="?",
+        const="",
+        metavar="URL_OR_FILE",
+        help=(
+            "Import or refresh the list of all Steam apps (from Steam unless "
+            "given), which allows game names in STEAM_WANTED_GAMES"
+        ),
+    )
+    main_group.add_argument(
+        "--find-steam-game", metavar="NAME", help="Look up appids in the Steam catalog"
+    )
 
     parser.add_argument(
         "-c",
         "--config-dir",
         type=Path,
-        default=Path(__file__).parent.parent,
-        help="Path to directory containing your .env",
+        nargs="+",
+        default=[Path(__file__).parent.parent],
+        help=(
+            "Path to directory containing your .env. "
+            "Running with several directories serves all of them from one process"
+        ),
     )
     parser.add_argument(
         "-s", "--script-dir", type=Path, default=Path(__file__), help="Path to main.py"
@@ -52,15 +81,59 @@ def parse_args():
         action="store_true",
         help="Skip installation of the systemd service. Useful on non-standard distros",
     )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Poll sources one after another instead of concurrently",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=0,
+        type=int,
+        metavar="CYCLES",
+        help=(
+            "With --sequential, write CPU and memory reports of every cycle "
+            "(or only the first CYCLES) to profile/ in the config directory"
+        ),
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help=(
+            "Run a single cycle and exit. "
+            "With --install, set up a systemd timer instead of a service"
+        ),
+    )
 
     args = parser.parse_args(sys.argv[1:] or ["--run"])
 
     if not args.script_dir.exists():
         print(f"Error: script not found at {args.script_dir}", file=sys.stderr)
         sys.exit(1)
-    if not args.config_dir.is_dir():
+    for config_dir in args.config_dir:
+        if not config_dir.is_dir():
+            print(
+                f"Error: config_dir is not a directory: {config_dir}", file=sys.stderr
+            )
+            sys.exit(1)
+    if args.once and args.sequential:
+        print("Error: --once and --sequential exclude each other", file=sys.stderr)
+        sys.exit(1)
+    if args.profile is not None and not args.sequential:
+        # the concurrent engine polls in threads cProfile does not see
+        print("Error: --profile needs --sequential", file=sys.stderr)
+        sys.exit(1)
+    single_dir_only = (
+        args.install
+        or args.sequential
+        or args.import_steam_catalog is not None
+        or args.find_steam_game
+    )
+    if len(args.config_dir) > 1 and single_dir_only:
         print(
-            f"Error: config_dir is not a directory: {args.config_dir}", file=sys.stderr
+            "Error: only --run takes several config_dirs",
+            file=sys.stderr,
         )
         sys.exit(1)
     return args
@@ -70,37 +143,82 @@ def main():
     """Load environment and get started."""
     args = parse_args()
 
-    config_dir = args.config_dir.resolve()
+    config_dirs = [config_dir.resolve() for config_dir in args.config_dir]
+    config_dir = config_dirs[0]
     script_dir = args.script_dir.resolve()
     skip_service_installation = args.no_service
 
     if args.install:
-        init(config_dir, script_dir, skip_service_installation)
+        init(config_dir, script_dir, skip_service_installation, args.once)
+    elif args.import_steam_catalog is not None:
+        from game_notifier import catalog
+
+        database.init_sqlite_db(config_dir)
+        changed = catalog.import_catalog(config_dir, args.import_steam_catalog)
+        print(f"steam catalog updated, {changed} apps added or renamed")
+    elif args.find_steam_game:
+        database.init_sqlite_db(config_dir)
+        db = database.open_database(config_dir)
+        for meta in db.search_steam_catalog(args.find_steam_game, limit=10):
+            print(meta.appid, meta.name)
     elif args.run:
-        dotenv_path = config_dir / ".env"
-        dotenv.load_dotenv(dotenv_path)
-
-        topic = os.getenv("NTFY_TOPIC")
-        if not topic:
-            print("Error: no topic set (NTFY_TOPIC)")
-            sys.exit(1)
-        poll_interval = int(os.getenv("POLL_INTERVAL", "60"))
-        notify_epic = os.getenv("EPIC_NOTIFY_FREE_GAMES", "").lower() in (
-            "true",
-            "1",
-            "yes",
-        )
-        steam_game_ids: list[int] = []
-        for raw_id in os.getenv("STEAM_WANTED_GAMES", "").split(","):
-            raw_id = raw_id.strip()
-            if not raw_id:
-                continue
+        from game_notifier import engine, fetcher, http_client, metrics
+
+        # keep the database handles open for the whole lifetime of the daemon,
+        # loading the settings already looks up steam games in them
+        for tenant_dir in config_dirs:
+            database.init_sqlite_db(tenant_dir)
+        configs: list[tuple[Path, config.Settings]] = []
+        for tenant_dir in config_dirs:
             try:
-                steam_game_ids.append(int(raw_id))
-            except ValueError:
-                continue
-
-        notifier.loop(topic, poll_interval, notify_epic, steam_game_ids, config_dir)
+                configs.append((tenant_dir, config.load_settings(tenant_dir)))
+            except ValueError as e:
+                print(f"Error in {tenant_dir}: {e}")
+                sys.exit(1)
+        # connection settings are shared, they come from the first directory
+        settings = configs[0][1]
+        http_client.configure(
+            connect_timeout=settings.http_connect_timeout,
+            read_timeout=settings.http_read_timeout,
+            max_retries=settings.http_max_retries,
+            pool_maxsize=settings.max_connections_per_host,
+            cache_dir=config_dir / "cache",
+            poll_deadline=settings.poll_deadline,
+        )
+        http_client.set_rate_limit(
+            fetcher.STEAM_HOST, settings.steam_requests_per_minute
+        )
+        # nobody would scrape a single cycle
+        if settings.metrics_port and not args.once:
+            metrics.serve(settings.metrics_port)
+
+        try:
+            if args.once:
+                engine.once(configs)
+            elif args.sequential:
+                from game_notifier import notifier
+
+                profiler = None
+                if args.profile is not None:
+                    from game_notifier.profiling import CycleProfiler
+
+                    profiler = CycleProfiler(config_dir, args.profile)
+                notifier.loop(
+                    settings.topic,
+                    settings.poll_interval,
+                    settings.notify_epic,
+                    list(settings.steam_game_ids),
+                    config_dir,
+                    settings.ntfy_rate_limit,
+                    settings.steam_alert_rules,
+                    settings.region,
+                    settings.ntfy_digest,
+                    profiler,
+                )
+            else:
+                engine.loop(configs)
+        finally:
+            database.close_databases()
 
 
 if __name__ == "__main__":